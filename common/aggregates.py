@@ -0,0 +1,109 @@
+# Shared execution layer for the window aggregates. Every engine evaluates any
+# combination of the aggregates below with a single pass over its input instead
+# of re-reading the source once per question.
+#
+#   top_color       most placed pixel_color
+#   top_coordinate  most placed coordinate
+#   distinct_users  number of distinct user_id values
+#   row_count       number of placements
+
+AGGREGATES = {
+    "top_color": "pixel_color",
+    "top_coordinate": "coordinate",
+    "distinct_users": "user_id",
+    "row_count": None,
+}
+
+def required_columns(aggregates):
+    columns = []
+    for name in aggregates:
+        column = AGGREGATES[name]
+        if column is not None and column not in columns:
+            columns.append(column)
+    return columns
+
+def run_duckdb(con, source, where, aggregates, columns=None):
+    # One GROUP BY GROUPING SETS over the source computes every aggregate in the
+    # same scan; the grouped rows are materialized so the outer selects do not
+    # re-read the source. `columns` maps a logical column to a SQL expression for
+    # sources that store it differently (e.g. coordinate built from x and y).
+    columns = columns or {}
+    needed = required_columns(aggregates)
+    projection = ", ".join(f"{columns.get(column, column)} AS {column}" for column in needed)
+    grouping = ", ".join(f"({column})" for column in needed)
+    sets = f"GROUPING SETS ({grouping}, ())" if needed else "()"
+    key = f"GROUPING({', '.join(needed)})" if needed else "0"
+
+    # GROUPING() sets bit i (from the left) when column i is *not* grouped
+    def set_id(column):
+        i = needed.index(column)
+        return (2 ** len(needed) - 1) ^ (1 << (len(needed) - 1 - i))
+    all_id = 2 ** len(needed) - 1 if needed else 0
+
+    selects = []
+    for name in aggregates:
+        column = AGGREGATES[name]
+        if name == "row_count":
+            selects.append(f"(SELECT n FROM grouped WHERE grouping_id = {all_id}) AS {name}")
+        elif name == "distinct_users":
+            selects.append(f"(SELECT COUNT(*) FROM grouped WHERE grouping_id = {set_id(column)}) AS {name}")
+        else:
+            selects.append(f"""(SELECT {column} FROM grouped WHERE grouping_id = {set_id(column)}
+                                ORDER BY n DESC LIMIT 1) AS {name}""")
+
+    query = f"""
+            WITH
+            filtered AS (
+                SELECT {projection if needed else '1 AS one'}
+                FROM {source}
+                WHERE {where}
+            ),
+            grouped AS MATERIALIZED (
+                SELECT {', '.join(needed + [''])}{key} AS grouping_id, COUNT(*) AS n
+                FROM filtered
+                GROUP BY {sets}
+            )
+            SELECT {', '.join(selects)}
+    """
+
+    result = con.execute(query).fetchall()
+    return dict(zip(aggregates, result[0]))
+
+def run_polars(lazy_df, aggregates, **collect_options):
+    # Build one lazy query per aggregate and collect them together so polars can
+    # share the scan and filter between them
+    import polars as pl
+
+    queries = []
+    for name in aggregates:
+        column = AGGREGATES[name]
+        if name == "row_count":
+            queries.append(lazy_df.select(pl.len().alias(name)))
+        elif name == "distinct_users":
+            queries.append(lazy_df.select(pl.col(column).n_unique().alias(name)))
+        else:
+            queries.append(
+                lazy_df
+                .group_by(column)
+                .len()
+                .sort("len", descending=True)
+                .head(1)
+                .select(pl.col(column).alias(name))
+            )
+
+    frames = pl.collect_all(queries, **collect_options)
+    return {name: (frame[0, name] if frame.height else None) for name, frame in zip(aggregates, frames)}
+
+def run_pandas(df, aggregates):
+    results = {}
+    for name in aggregates:
+        column = AGGREGATES[name]
+        if name == "row_count":
+            results[name] = len(df)
+        elif name == "distinct_users":
+            results[name] = df[column].nunique()
+        else:
+            # Counts in order of first appearance, so ties go to the value seen first
+            counts = df[column].value_counts(sort=False)
+            results[name] = counts.idxmax() if len(counts) else None
+    return results
@@ -0,0 +1,246 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+# One entry point for the "most placed color / coordinate in a window" query over
+# every engine in the repo. Each engine takes the window bounds ('YYYY-MM-DD HH'),
+# the raw csv and the preprocessed data directory, and returns (color, coordinate)
+# with color as a hex string and coordinate as "x,y" (or "x1,y1,x2,y2" for a
+# moderator rectangle).
+#
+#   csv             week1 csv module scan
+#   csv-parallel    week1 scan split over worker processes
+#   pandas          week2 pandas
+#   pandas-chunked  week2 pandas, streamed in blocks within a memory budget
+#   polars          week2 polars
+#   polars-parquet  week2 polars over the week3 parquet files
+#   duckdb-csv      week2 duckDB over the csv
+#   duckdb-parquet  duckDB over the week3 parquet files
+#   spark-local     pyspark local[*] over the week3 parquet files
+#   rollup          hourly rollup cube (common/rollup.py)
+#   colstore        memory mapped raw column store (common/colstore.py)
+#
+# With --json the answer is printed as one JSON line together with the wall time,
+# CPU time, peak RSS and bytes read of the query, which is what benchmark.py runs.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+from common.dates import checkDates, parse_hour, to_epoch_ms
+from common.rollup import DATA_DIR, events_sql
+
+CSV_FILE = os.path.join(os.path.dirname(REPO_DIR), '2022_place_canvas_history.csv')
+
+COORDINATE_SQL = """CASE WHEN x2 IS NULL THEN CAST(x AS VARCHAR) || ',' || CAST(y AS VARCHAR)
+                    ELSE CAST(x AS VARCHAR) || ',' || CAST(y AS VARCHAR) || ','
+                         || CAST(x2 AS VARCHAR) || ',' || CAST(y2 AS VARCHAR) END"""
+
+def load_script(week, name):
+    # The week folders are plain script directories, import from them by path
+    path = os.path.join(REPO_DIR, week)
+    if path not in sys.path:
+        sys.path.append(path)
+    return importlib.import_module(name)
+
+def data_files(data_dir):
+    return (os.path.join(data_dir, 'rPlace.parquet'),
+            os.path.join(data_dir, 'rPlace_rectangles.parquet'),
+            os.path.join(data_dir, 'palette.parquet'))
+
+def csv_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    analyzer = load_script('week1', 'analyzer')
+    return analyzer.main(parse_hour(startDate), parse_hour(endDate), csv_file)
+
+def csv_parallel_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    analyzer = load_script('week1', 'analyzer')
+    return analyzer.parallelMain(parse_hour(startDate), parse_hour(endDate), csv_file=csv_file)
+
+def pandas_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    return load_script('week2', 'pd_analyzer').pandas(startDate, endDate, csv_file)
+
+def pandas_chunked_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    return load_script('week2', 'pd_analyzer').pandas_chunked(startDate, endDate, csv_file)
+
+def polars_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    return load_script('week2', 'polars_analyzer').polars(startDate, endDate, csv_file)
+
+def polars_parquet_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    return load_script('week2', 'polars_analyzer').polars(startDate, endDate,
+                                                          parquet_file=data_files(data_dir)[0])
+
+def duckdb_csv_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    return load_script('week2', 'duckDB_analyzer').duckDB(startDate, endDate, csv_file)
+
+def duckdb_parquet_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    import duckdb
+    from common.aggregates import run_duckdb
+
+    parquet_file, rectangle_file, palette_file = data_files(data_dir)
+    con = duckdb.connect()
+    source = f"{events_sql(parquet_file, rectangle_file)} events JOIN read_parquet('{palette_file}') palette USING (color_index)"
+    result = run_duckdb(con, source, f"timestamp BETWEEN {to_epoch_ms(startDate)} AND {to_epoch_ms(endDate)}",
+                        ["top_color", "top_coordinate"],
+                        columns={"pixel_color": "palette.pixel_color", "coordinate": COORDINATE_SQL})
+    con.close()
+
+    return result["top_color"], result["top_coordinate"]
+
+def spark_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    from pyspark.sql import SparkSession
+
+    parquet_file, rectangle_file, palette_file = data_files(data_dir)
+    spark = SparkSession.builder.master("local[*]").appName("rPlace analyze").getOrCreate()
+    spark.read.parquet(parquet_file).createOrReplaceTempView("pixels")
+    spark.read.parquet(rectangle_file).createOrReplaceTempView("rectangles")
+    spark.read.parquet(palette_file).createOrReplaceTempView("palette")
+
+    spark.sql(f"""
+              SELECT timestamp, color_index, x, y, CAST(NULL AS SMALLINT) AS x2, CAST(NULL AS SMALLINT) AS y2
+              FROM pixels
+              WHERE timestamp BETWEEN {to_epoch_ms(startDate)} AND {to_epoch_ms(endDate)}
+              UNION ALL
+              SELECT timestamp, color_index, x1 AS x, y1 AS y, x2, y2
+              FROM rectangles
+              WHERE timestamp BETWEEN {to_epoch_ms(startDate)} AND {to_epoch_ms(endDate)}
+              """).cache().createOrReplaceTempView("placed")
+
+    color = spark.sql("""
+                      SELECT palette.pixel_color
+                      FROM placed JOIN palette USING (color_index)
+                      GROUP BY palette.pixel_color
+                      ORDER BY COUNT(*) DESC
+                      LIMIT 1
+                      """).collect()
+    coord = spark.sql(f"""
+                      SELECT {COORDINATE_SQL.replace('VARCHAR', 'STRING')}
+                      FROM placed
+                      GROUP BY x, y, x2, y2
+                      ORDER BY COUNT(*) DESC
+                      LIMIT 1
+                      """).collect()
+    spark.stop()
+
+    return (color[0][0] if color else None), (coord[0][0] if coord else None)
+
+def rollup_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    from common.rollup import query_rollup
+
+    parquet_file, rectangle_file, palette_file = data_files(data_dir)
+    return query_rollup(startDate, endDate, os.path.join(data_dir, 'rollup'), parquet_file,
+                        rectangle_file, palette_file)
+
+def colstore_engine(startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    from common.colstore import top_placed
+
+    _, rectangle_file, palette_file = data_files(data_dir)
+    return top_placed(startDate, endDate, os.path.join(data_dir, 'rPlace_columns'), rectangle_file, palette_file)
+
+ENGINES = {
+    "csv": csv_engine,
+    "csv-parallel": csv_parallel_engine,
+    "pandas": pandas_engine,
+    "pandas-chunked": pandas_chunked_engine,
+    "polars": polars_engine,
+    "polars-parquet": polars_parquet_engine,
+    "duckdb-csv": duckdb_csv_engine,
+    "duckdb-parquet": duckdb_parquet_engine,
+    "spark-local": spark_engine,
+    "rollup": rollup_engine,
+    "colstore": colstore_engine,
+}
+
+# Modules each engine needs, imported before the timer starts so interpreter and
+# library start up is not counted as query time
+ENGINE_IMPORTS = {
+    "csv": [("week1", "analyzer")],
+    "csv-parallel": [("week1", "analyzer")],
+    "pandas": [("week2", "pd_analyzer")],
+    "pandas-chunked": [("week2", "pd_analyzer")],
+    "polars": [("week2", "polars_analyzer")],
+    "polars-parquet": [("week2", "polars_analyzer")],
+    "duckdb-csv": [("week2", "duckDB_analyzer")],
+    "duckdb-parquet": [(None, "duckdb"), (None, "common.aggregates")],
+    "spark-local": [(None, "pyspark.sql")],
+    "rollup": [(None, "duckdb")],
+    "colstore": [(None, "common.colstore")],
+}
+
+def preload(engine):
+    for week, name in ENGINE_IMPORTS[engine]:
+        if week is None:
+            importlib.import_module(name)
+        else:
+            load_script(week, name)
+
+def bytes_read():
+    # Bytes this process (and its reaped children) read through read() calls,
+    # page cache hits included; None where /proc is not available
+    try:
+        with open('/proc/self/io') as file:
+            return int(dict(line.split(": ") for line in file.read().splitlines())["rchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def usage():
+    import resource
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return cpu, max(own.ru_maxrss, children.ru_maxrss) * scale
+
+def measure(engine, startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    # Run one query and record what it cost. Peak RSS is for the whole process, so
+    # benchmark.py runs every measurement in a fresh interpreter.
+    preload(engine)
+
+    startCpu, _ = usage()
+    startRead = bytes_read()
+    startTime = time.perf_counter_ns()
+
+    color, coord = ENGINES[engine](startDate, endDate, csv_file, data_dir)
+
+    endTime = time.perf_counter_ns()
+    endCpu, peakRss = usage()
+    endRead = bytes_read()
+
+    return {
+        "engine": engine,
+        "start": startDate,
+        "end": endDate,
+        "color": color,
+        "coordinate": coord,
+        "wall_ms": (endTime - startTime) / 1_000_000,
+        "cpu_s": endCpu - startCpu,
+        "peak_rss": peakRss,
+        "bytes_read": endRead - startRead if startRead is not None else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Most placed color and pixel location in a window")
+    parser.add_argument("engine", choices=list(ENGINES))
+    parser.add_argument("start_date")
+    parser.add_argument("end_date")
+    parser.add_argument("--csv", default=CSV_FILE, help="raw r/place csv")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="directory with the preprocessed parquet files")
+    parser.add_argument("--json", action="store_true", help="print the result and its cost as one JSON line")
+    options = parser.parse_args()
+
+    # Validate and start and end date
+    startDate, endDate = checkDates(options.start_date, options.end_date)
+
+    result = measure(options.engine, startDate, endDate, os.path.abspath(options.csv),
+                     os.path.abspath(options.data_dir))
+
+    if options.json:
+        print(json.dumps(result))
+    else:
+        print(f"**Engine:** {options.engine}")
+        print(f"**Timeframe:** {startDate} to {endDate}")
+        print(f"**Execution Time:** {result['wall_ms']:.6f} ms")
+        print(f"**Most Placed Color:** {result['color']} ")
+        print(f"**Most Placed Pixel Location:** {result['coordinate']} ")
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import Counter
+from datetime import datetime
+
+# Benchmark harness for analyze.py. Every engine answers the same fixed matrix of
+# windows; each run happens in a fresh interpreter so peak RSS and bytes read are
+# the query's own. Warmup runs are discarded (they fill the page cache and build
+# any hour index / sidecar files), the remaining runs are summarized by their
+# median, and the answers of all engines are checked against each other. The
+# results are written as a markdown report in the style of test_results_*.md.
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.analyze import CSV_FILE, DATA_DIR, ENGINES
+
+ANALYZE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analyze.py')
+RESULTS_FILE = 'benchmark_results.md'
+
+# The windows used for the weekly results
+QUERY_MATRIX = [
+    ("2022-04-04 00", "2022-04-04 01"),
+    ("2022-04-04 00", "2022-04-04 03"),
+    ("2022-04-04 00", "2022-04-04 06"),
+]
+
+DEFAULT_ENGINES = ["csv", "pandas", "polars", "duckdb-csv", "duckdb-parquet", "spark-local"]
+
+def run_once(engine, startDate, endDate, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    command = [sys.executable, ANALYZE, engine, startDate, endDate, "--json",
+               "--csv", csv_file, "--data-dir", data_dir]
+    output = subprocess.run(command, capture_output=True, text=True)
+    if output.returncode != 0:
+        lines = output.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else f"exit status {output.returncode}"}
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def run_benchmark(engines, windows=QUERY_MATRIX, warmup=1, repeat=3, csv_file=CSV_FILE, data_dir=DATA_DIR):
+    # {(engine, window): [measured runs]}; an engine that fails is not retried
+    results = {}
+    for startDate, endDate in windows:
+        for engine in engines:
+            print(f"{engine}: {startDate} to {endDate}", file=sys.stderr)
+            runs = []
+            for i in range(warmup + repeat):
+                run = run_once(engine, startDate, endDate, csv_file, data_dir)
+                if "error" in run:
+                    runs = [run]
+                    break
+                if i >= warmup:
+                    runs.append(run)
+            results[(engine, (startDate, endDate))] = runs
+    return results
+
+def summarize(runs):
+    if not runs or "error" in runs[0]:
+        return {"error": runs[0]["error"] if runs else "no runs"}
+
+    answers = {(run["color"], run["coordinate"]) for run in runs}
+    bytes_read = [run["bytes_read"] for run in runs if run["bytes_read"] is not None]
+    return {
+        "color": runs[0]["color"],
+        "coordinate": runs[0]["coordinate"],
+        "stable": len(answers) == 1,
+        "wall_ms": statistics.median(run["wall_ms"] for run in runs),
+        "wall_min_ms": min(run["wall_ms"] for run in runs),
+        "cpu_s": statistics.median(run["cpu_s"] for run in runs),
+        "peak_rss": max(run["peak_rss"] for run in runs),
+        "bytes_read": statistics.median(bytes_read) if bytes_read else None,
+    }
+
+def check_answers(summaries):
+    # The answer most engines agree on, and the engines that gave something else
+    answers = {engine: (summary["color"], summary["coordinate"])
+               for engine, summary in summaries.items() if "error" not in summary}
+    if not answers:
+        return None, []
+    expected = Counter(answers.values()).most_common(1)[0][0]
+    mismatches = [engine for engine, answer in answers.items() if answer != expected]
+    mismatches += [engine for engine, summary in summaries.items()
+                   if "error" not in summary and not summary["stable"]]
+    return expected, sorted(set(mismatches))
+
+def window_title(startDate, endDate):
+    hours = (datetime.strptime(endDate, "%Y-%m-%d %H") - datetime.strptime(startDate, "%Y-%m-%d %H"))
+    return f"{int(hours.total_seconds() // 3600)}-Hour Timeframe"
+
+def megabytes(value):
+    return "n/a" if value is None else f"{value / 1024 / 1024:.1f}"
+
+def to_markdown(results, engines, windows=QUERY_MATRIX, warmup=1, repeat=3):
+    lines = ["# Benchmark Results", "",
+             f"{warmup} warmup run(s) and {repeat} measured run(s) per engine and window, each in a fresh process.",
+             "Wall and CPU time are medians of the measured runs, peak RSS the largest and bytes read the",
+             "median bytes passed through read() (page cache hits included, memory mapped reads not).",
+             "CPU time and RSS of the Spark JVM are not included."]
+    consistent = True
+
+    for window in windows:
+        summaries = {engine: summarize(results.get((engine, window), [])) for engine in engines}
+        expected, mismatches = check_answers(summaries)
+        consistent = consistent and not mismatches
+
+        lines += ["", f"## {window_title(*window)}", "",
+                  f"- **Timeframe:** {window[0]} to {window[1]}"]
+        if expected is not None:
+            lines += [f"- **Most Placed Color:** {expected[0]}",
+                      f"- **Most Placed Pixel Location:** {expected[1]}"]
+        if mismatches:
+            lines.append(f"- **Mismatched engines:** {', '.join(mismatches)}")
+
+        lines += ["", "| Engine | Wall (ms) | Min wall (ms) | CPU (s) | Peak RSS (MB) | Read (MB) | Answer |",
+                  "|---|---:|---:|---:|---:|---:|---|"]
+        for engine, summary in summaries.items():
+            if "error" in summary:
+                lines.append(f"| {engine} | | | | | | failed: {summary['error']} |")
+                continue
+            answer = "matches" if engine not in mismatches else f"{summary['color']} / {summary['coordinate']}"
+            lines.append(f"| {engine} | {summary['wall_ms']:.3f} | {summary['wall_min_ms']:.3f} "
+                         f"| {summary['cpu_s']:.3f} | {megabytes(summary['peak_rss'])} "
+                         f"| {megabytes(summary['bytes_read'])} | {answer} |")
+
+    return "\n".join(lines) + "\n", consistent
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analyze.py engines over a fixed query matrix")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=DEFAULT_ENGINES)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--csv", default=CSV_FILE, help="raw r/place csv")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="directory with the preprocessed parquet files")
+    parser.add_argument("--output", default=RESULTS_FILE, help="markdown report to write")
+    options = parser.parse_args()
+
+    if options.repeat < 1 or options.warmup < 0:
+        print("Error: --repeat must be at least 1 and --warmup at least 0.")
+        sys.exit(1)
+
+    results = run_benchmark(options.engines, QUERY_MATRIX, options.warmup, options.repeat,
+                            os.path.abspath(options.csv), os.path.abspath(options.data_dir))
+    report, consistent = to_markdown(results, options.engines, QUERY_MATRIX, options.warmup, options.repeat)
+
+    with open(options.output, 'w') as file:
+        file.write(report)
+
+    print(report)
+    if not consistent:
+        print("Error: engines disagree on some windows, see the report.")
+        sys.exit(1)
@@ -0,0 +1,212 @@
+import bisect
+import json
+import os
+import sys
+import time
+import numpy as np
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.dates import to_epoch_ms
+from common.hour_index import source_fingerprint
+from common.rollup import DATA_DIR, PALETTE_FILE, PARQUET_FILE, RECTANGLE_FILE
+from common.tiles import CANVAS_SIZE
+
+# Canvas state reconstruction. Replaying the placements (and moderator rectangle
+# edits) in time order into a uint8 array of palette indexes gives the canvas at
+# any moment. Keyframes of the full canvas are saved every KEYFRAME_INTERVAL_MS of
+# event time, so seeking to time T loads the last keyframe at or before T and only
+# replays the events after it.
+#
+# The canvas at time T includes every event with timestamp <= T. A rectangle edit
+# is applied before pixel placements that share its timestamp. keyframes.json
+# records the fingerprint of the files the keyframes were built from, and they are
+# refused once those files change.
+
+KEYFRAME_DIR = os.path.join(DATA_DIR, 'keyframes')
+
+KEYFRAME_INTERVAL_MS = 10 * 60 * 1000
+BATCH_ROWS = 1_000_000
+BACKGROUND = "#FFFFFF"
+
+def background_index(palette_file=PALETTE_FILE):
+    palette = pq.read_table(palette_file).to_pydict()
+    return palette["color_index"][palette["pixel_color"].index(BACKGROUND)]
+
+def load_rectangles(rectangle_file=RECTANGLE_FILE):
+    if not os.path.exists(rectangle_file):
+        return {name: np.array([], dtype=np.int64) for name in ("timestamp", "color_index", "x1", "y1", "x2", "y2")}
+    table = pq.read_table(rectangle_file, columns=["timestamp", "color_index", "x1", "y1", "x2", "y2"])
+    return {name: table.column(name).to_numpy() for name in table.column_names}
+
+def paint_pixels(canvas, x, y, color, x0=0, y0=0):
+    # canvas covers the pixels starting at (x0, y0); later placements win
+    if len(x) == 0:
+        return
+    x = x.astype(np.int64) - x0
+    y = y.astype(np.int64) - y0
+    inside = (x >= 0) & (x < canvas.shape[1]) & (y >= 0) & (y < canvas.shape[0])
+    keys = (y * canvas.shape[1] + x)[inside]
+    color = color[inside]
+
+    # Fancy assignment does not promise an order for repeated pixels, keep the last
+    _, last_reversed = np.unique(keys[::-1], return_index=True)
+    last = len(keys) - 1 - last_reversed
+    canvas.reshape(-1)[keys[last]] = color[last]
+
+def paint_rectangle(canvas, rectangles, i, x0=0, y0=0):
+    x1 = max(int(rectangles["x1"][i]) - x0, 0)
+    y1 = max(int(rectangles["y1"][i]) - y0, 0)
+    x2 = min(int(rectangles["x2"][i]) - x0, canvas.shape[1] - 1)
+    y2 = min(int(rectangles["y2"][i]) - y0, canvas.shape[0] - 1)
+    if x1 <= x2 and y1 <= y2:
+        canvas[y1:y2 + 1, x1:x2 + 1] = rectangles["color_index"][i]
+
+def replay(canvas, timestamps, x, y, color, rectangles, next_rectangle, limit, x0=0, y0=0):
+    # Apply the sorted pixel events plus every pending rectangle stamped <= limit.
+    # Returns the index of the first rectangle still pending.
+    start = 0
+    while next_rectangle < len(rectangles["timestamp"]) and rectangles["timestamp"][next_rectangle] <= limit:
+        position = np.searchsorted(timestamps, rectangles["timestamp"][next_rectangle], side="left")
+        paint_pixels(canvas, x[start:position], y[start:position], color[start:position], x0, y0)
+        paint_rectangle(canvas, rectangles, next_rectangle, x0, y0)
+        start = max(start, position)
+        next_rectangle += 1
+    paint_pixels(canvas, x[start:], y[start:], color[start:], x0, y0)
+    return next_rectangle
+
+def source_fingerprints(parquet_file, rectangle_file):
+    return {"parquet": source_fingerprint(parquet_file),
+            "rectangles": source_fingerprint(rectangle_file) if os.path.exists(rectangle_file) else None}
+
+def build_keyframes(parquet_file=PARQUET_FILE, rectangle_file=RECTANGLE_FILE, palette_file=PALETTE_FILE,
+                    keyframe_dir=KEYFRAME_DIR, interval_ms=KEYFRAME_INTERVAL_MS):
+    os.makedirs(keyframe_dir, exist_ok=True)
+    background = background_index(palette_file)
+    canvas = np.full((CANVAS_SIZE, CANVAS_SIZE), background, dtype=np.uint8)
+    rectangles = load_rectangles(rectangle_file)
+    next_rectangle = 0
+    next_keyframe = None
+    keyframes = []
+
+    def save(moment):
+        np.save(os.path.join(keyframe_dir, f"{moment}.npy"), canvas)
+        keyframes.append(moment)
+
+    parquet = pq.ParquetFile(parquet_file)
+    for batch in parquet.iter_batches(BATCH_ROWS, columns=["timestamp", "x", "y", "color_index"]):
+        timestamps = batch.column("timestamp").to_numpy()
+        x = batch.column("x").to_numpy()
+        y = batch.column("y").to_numpy()
+        color = batch.column("color_index").to_numpy()
+        if len(timestamps) == 0:
+            continue
+
+        if next_keyframe is None:
+            # First keyframe is the blank canvas, on the last boundary before any event
+            first = int(timestamps[0])
+            if len(rectangles["timestamp"]):
+                first = min(first, int(rectangles["timestamp"][0]))
+            next_keyframe = (first - 1) // interval_ms * interval_ms
+            save(next_keyframe)
+            next_keyframe += interval_ms
+
+        start = 0
+        while True:
+            position = np.searchsorted(timestamps, next_keyframe, side="right")
+            if position == len(timestamps):
+                next_rectangle = replay(canvas, timestamps[start:], x[start:], y[start:], color[start:],
+                                        rectangles, next_rectangle, timestamps[-1])
+                break
+            next_rectangle = replay(canvas, timestamps[start:position], x[start:position], y[start:position],
+                                    color[start:position], rectangles, next_rectangle, next_keyframe)
+            save(next_keyframe)
+            next_keyframe += interval_ms
+            start = position
+
+    # A final keyframe, then one more on the boundary at or after each later
+    # rectangle, so no keyframe holds an edit stamped after its own time
+    if next_keyframe is not None:
+        empty = np.array([], dtype=np.int64)
+        while True:
+            next_rectangle = replay(canvas, empty, empty, empty, empty.astype(np.uint8), rectangles,
+                                    next_rectangle, next_keyframe)
+            save(next_keyframe)
+            if next_rectangle == len(rectangles["timestamp"]):
+                break
+            pending = int(rectangles["timestamp"][next_rectangle])
+            next_keyframe = max(next_keyframe + interval_ms, -(-pending // interval_ms) * interval_ms)
+
+    with open(os.path.join(keyframe_dir, "keyframes.json"), "w") as file:
+        json.dump({"interval_ms": interval_ms, "background": int(background), "keyframes": keyframes,
+                   "sources": source_fingerprints(parquet_file, rectangle_file)}, file)
+
+    return keyframes
+
+class CanvasHistory:
+    def __init__(self, keyframe_dir=KEYFRAME_DIR, parquet_file=PARQUET_FILE, rectangle_file=RECTANGLE_FILE):
+        with open(os.path.join(keyframe_dir, "keyframes.json")) as file:
+            meta = json.load(file)
+        if meta.get("sources") != source_fingerprints(parquet_file, rectangle_file):
+            raise ValueError(f"Keyframes in {keyframe_dir} were built from another version of {parquet_file}, "
+                             "rebuild them with canvas.py build")
+        self.keyframe_dir = keyframe_dir
+        self.keyframes = meta["keyframes"]
+        self.background = meta["background"]
+        self.parquet_file = parquet_file
+        self.rectangles = load_rectangles(rectangle_file)
+
+    def snapshot(self, moment, box=None):
+        # Palette indexes of the canvas at `moment` (epoch ms, datetime or
+        # 'YYYY-MM-DD HH:MM:SS'), optionally only the inclusive box (x1, y1, x2, y2)
+        moment = to_epoch_ms(moment)
+        x1, y1, x2, y2 = box if box is not None else (0, 0, CANVAS_SIZE - 1, CANVAS_SIZE - 1)
+
+        k = bisect.bisect_right(self.keyframes, moment) - 1
+        if k < 0:
+            return np.full((y2 - y1 + 1, x2 - x1 + 1), self.background, dtype=np.uint8)
+
+        base = self.keyframes[k]
+        keyframe = np.load(os.path.join(self.keyframe_dir, f"{base}.npy"), mmap_mode="r")
+        canvas = np.array(keyframe[y1:y2 + 1, x1:x2 + 1])
+
+        # The dataset is sorted by time, so this only reads the row groups after the keyframe
+        filters = [("timestamp", ">", base), ("timestamp", "<=", moment)]
+        if box is not None:
+            filters += [("x", ">=", x1), ("x", "<=", x2), ("y", ">=", y1), ("y", "<=", y2)]
+        events = pq.read_table(self.parquet_file, columns=["timestamp", "x", "y", "color_index"], filters=filters)
+        events = events.sort_by("timestamp")
+
+        rectangles = self.rectangles
+        first = np.searchsorted(rectangles["timestamp"], base, side="right")
+        replay(canvas, events.column("timestamp").to_numpy(), events.column("x").to_numpy(),
+               events.column("y").to_numpy(), events.column("color_index").to_numpy(),
+               rectangles, first, moment, x1, y1)
+
+        return canvas
+
+def to_rgb(canvas, palette_file=PALETTE_FILE):
+    palette = pq.read_table(palette_file).to_pydict()
+    colors = np.zeros((256, 3), dtype=np.uint8)
+    for index, hex_color in zip(palette["color_index"], palette["pixel_color"]):
+        colors[index] = [int(hex_color[i:i + 2], 16) for i in (1, 3, 5)]
+    return colors[canvas]
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "build" and len(sys.argv) <= 3:
+        interval_ms = int(sys.argv[2]) * 60 * 1000 if len(sys.argv) == 3 else KEYFRAME_INTERVAL_MS
+        startTime = time.perf_counter_ns()
+        keyframes = build_keyframes(interval_ms=interval_ms)
+        elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+        print(f"Wrote {len(keyframes)} keyframes to {KEYFRAME_DIR} in {elapsedTime_ms:.2f} ms")
+    elif len(sys.argv) == 4 and sys.argv[1] == "snapshot":
+        import matplotlib.pyplot as plt
+        startTime = time.perf_counter_ns()
+        canvas = CanvasHistory().snapshot(sys.argv[2])
+        elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+        plt.imsave(sys.argv[3], to_rgb(canvas))
+        print(f"**Execution Time:** {elapsedTime_ms:.4f} ms")
+    else:
+        print("Usage: canvas.py build [interval_minutes]")
+        print("       canvas.py snapshot '<YYYY-MM-DD HH:MM:SS>' <output.png>")
+        sys.exit(1)
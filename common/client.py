@@ -0,0 +1,121 @@
+import json
+import os
+import sys
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+# Command line front end for server.py. Prints the same report as the per week
+# scripts, without paying for their imports and connection setup on every run.
+#
+#   client.py top <start_date> <end_date>
+#   client.py color_ranking <start_date> <end_date> [--mode=approx]
+#   client.py sessions <start_date> <end_date> [--gap=seconds]
+#   client.py percentiles <start_date> <end_date> [--q=0.5,0.9]
+#   client.py first_time_users <start_date> <end_date>
+#   client.py report <start_date> <end_date>      (the week3 report: all four above)
+#   client.py regions [--config=regions.json] [--mode=approx]
+#   client.py health
+#
+# --server=http://host:port points at a server other than the default.
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.dates import checkDates
+from common.palette import names_for
+
+SERVER = 'http://127.0.0.1:8369'
+WINDOWED = ["top", "color_ranking", "sessions", "percentiles", "first_time_users", "report"]
+
+def request(server, analysis, params):
+    try:
+        with urlopen(f"{server}/{analysis}?{urlencode(params)}") as response:
+            return json.load(response)["result"]
+    except HTTPError as error:
+        print(f"Error: {json.load(error).get('error', error.reason)}")
+        sys.exit(1)
+    except URLError as error:
+        print(f"Error: could not reach {server} ({error.reason}), is server.py running?")
+        sys.exit(1)
+
+def print_top(result):
+    print(f"**Most Placed Color:** {result['color']} ")
+    print(f"**Most Placed Pixel Location:** {result['coordinate']} ")
+
+def print_color_ranking(result):
+    if result["mode"] == "approx":
+        print(f"**Top Ranking of Colors by Distinct Users** (approximate, ±{result['error_bound']:.2%})")
+    else:
+        print("**Top Ranking of Colors by Distinct Users**")
+    color_names = names_for([color for color, _ in result["ranking"]])
+    for i, (_, count) in enumerate(result["ranking"]):
+        print(f"{i + 1}. {color_names[i]}: {count} users")
+    print()
+
+def print_sessions(result):
+    length = result["average_session_length"]
+    print("**Average Session Length**")
+    print(f"Output: {length:.2f} seconds\n" if length is not None else "Output: no sessions\n")
+
+def print_percentiles(result):
+    print("**Percentiles of Pixels Placed**")
+    for q, value in result.items():
+        print(f"{float(q) * 100:g}th Percentile: {value} pixels")
+    print()
+
+def print_first_time_users(result):
+    print("**Count of First-Time Users**")
+    print(f"Output: {result['first_time_users']} users\n")
+
+def print_regions(result):
+    print("\n**Results**")
+    for region in result["regions"]:
+        top_colors = ", ".join(f"{color} ({count})" for color, count in region["top_colors"])
+        print(f"{region['name']} Distinct Users: {region['distinct_users']}, Top Colors: {top_colors}")
+    names = [region["name"] for region in result["regions"]]
+    print("\n**User Overlap**")
+    for name, row in zip(names, result["overlap"]):
+        print(f"{name}: " + ", ".join(f"{other} {count}" for other, count in zip(names, row)))
+
+def print_health(result):
+    print(f"**Rows:** {result['rows']} in {result['row_groups']} row groups, {result['colors']} colors")
+
+PRINTERS = {
+    "top": print_top,
+    "color_ranking": print_color_ranking,
+    "sessions": print_sessions,
+    "percentiles": print_percentiles,
+    "first_time_users": print_first_time_users,
+    "regions": print_regions,
+    "health": print_health,
+}
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    server = options.pop("server", SERVER)
+
+    analyses = list(PRINTERS) + ["report"]
+    if not args or args[0] not in analyses or len(args) != (3 if args[0] in WINDOWED else 1):
+        print("Usage: client.py <analysis> [<start_date> <end_date>] [--option=value ...] [--server=url]")
+        print(f"Analyses: {', '.join(analyses)}")
+        sys.exit(1)
+
+    analysis = args[0]
+    params = dict(options)
+    if analysis in WINDOWED:
+        # Validate and start and end date
+        params["start"], params["end"] = checkDates(args[1], args[2])
+
+    # Start the timer
+    startTime = time.perf_counter_ns()
+
+    parts = ["color_ranking", "sessions", "percentiles", "first_time_users"] if analysis == "report" else [analysis]
+    for part in parts:
+        PRINTERS[part](request(server, part, params))
+
+    elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+
+    if analysis in WINDOWED:
+        print(f"**Timeframe:** {params['start']} to {params['end']}")
+    print(f"**Execution Time:** {elapsedTime_ms:.4f} ms")
@@ -0,0 +1,252 @@
+import argparse
+import os
+import shutil
+import struct
+import sys
+import time
+from collections import Counter
+import numpy as np
+import pyarrow.parquet as pq
+
+# Raw column store. The time sorted rPlace.parquet exported once as fixed width
+# little endian arrays, one file per column, so a query maps the files with
+# np.memmap and aggregates slices of them with np.bincount: no decompression or
+# decoding, and repeated queries run straight out of the page cache.
+#
+#   rPlace_columns/timestamp.bin          int64 epoch ms, ascending
+#   rPlace_columns/x.bin, y.bin           int16
+#   rPlace_columns/color_index.bin        uint8
+#   rPlace_columns/user_id_numerical.bin  uint32
+#   rPlace_columns/hours.bin              int64 row offsets, entry i is the first row
+#                                         at or after hour first_hour + i; the last
+#                                         entry is the row count
+#
+# Every file starts with a HEADER_SIZE byte header (magic, version, numpy dtype,
+# number of values, and for hours.bin the first hour since the epoch) and the
+# values follow it. Moderator rectangles stay in rPlace_rectangles.parquet.
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.dates import checkDates, to_epoch_ms
+from common.rollup import DATA_DIR, HOUR_MS, PALETTE_FILE, PARQUET_FILE, RECTANGLE_FILE
+from common.tiles import CANVAS_SIZE
+
+STORE_DIR = os.path.join(DATA_DIR, 'rPlace_columns')
+
+MAGIC = b"RPLACECS"
+VERSION = 1
+HEADER = struct.Struct("<8sH2x4sQq")  # magic, version, dtype, values, first hour
+HEADER_SIZE = 64
+
+COLUMNS = {
+    "timestamp": np.dtype("<i8"),
+    "x": np.dtype("<i2"),
+    "y": np.dtype("<i2"),
+    "color_index": np.dtype("u1"),
+    "user_id_numerical": np.dtype("<u4"),
+}
+HOURS = "hours"
+HOURS_DTYPE = np.dtype("<i8")
+
+BATCH_ROWS = 1_000_000
+CHUNK_ROWS = 8_000_000  # rows per bincount, bounds the temporary key arrays
+
+def column_file(store_dir, name):
+    return os.path.join(store_dir, name + '.bin')
+
+def write_header(file, dtype, values, first_hour=0):
+    file.write(HEADER.pack(MAGIC, VERSION, dtype.str.encode(), values, first_hour).ljust(HEADER_SIZE, b"\0"))
+
+def read_header(path, dtype):
+    with open(path, 'rb') as file:
+        magic, version, stored_dtype, values, first_hour = HEADER.unpack(file.read(HEADER_SIZE)[:HEADER.size])
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} column file")
+    if stored_dtype.rstrip(b"\0").decode() != dtype.str:
+        raise ValueError(f"{path} holds {stored_dtype.decode()} values, expected {dtype.str}")
+    if os.path.getsize(path) != HEADER_SIZE + values * dtype.itemsize:
+        raise ValueError(f"{path} is truncated")
+    return values, first_hour
+
+def export_columns(parquet_file=PARQUET_FILE, store_dir=STORE_DIR, batch_rows=BATCH_ROWS):
+    # Stream the parquet into the column files, then index the hours. Written to a
+    # sibling directory first so a failed export never leaves a mixed store behind.
+    parquet = pq.ParquetFile(parquet_file)
+    rows = parquet.metadata.num_rows
+    tmp_dir = store_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    files = {name: open(column_file(tmp_dir, name), 'wb') for name in COLUMNS}
+    try:
+        for name, file in files.items():
+            write_header(file, COLUMNS[name], rows)
+
+        written = 0
+        last_timestamp = None
+        for batch in parquet.iter_batches(batch_size=batch_rows, columns=list(COLUMNS)):
+            timestamps = batch.column("timestamp").to_numpy()
+            # The hour index and the window slicing rely on timestamp order
+            if len(timestamps) and ((last_timestamp is not None and timestamps[0] < last_timestamp)
+                                    or np.any(timestamps[1:] < timestamps[:-1])):
+                raise ValueError(f"{parquet_file} is not sorted by timestamp")
+            if len(timestamps):
+                last_timestamp = timestamps[-1]
+
+            for name, file in files.items():
+                batch.column(name).to_numpy().astype(COLUMNS[name], copy=False).tofile(file)
+            written += batch.num_rows
+    finally:
+        for file in files.values():
+            file.close()
+
+    if written != rows:
+        raise ValueError(f"Read {written} rows from {parquet_file}, its metadata says {rows}")
+
+    timestamps = open_column(column_file(tmp_dir, "timestamp"), COLUMNS["timestamp"])[0]
+    if rows:
+        first_hour = int(timestamps[0]) // HOUR_MS
+        hour_starts = np.arange(first_hour, int(timestamps[-1]) // HOUR_MS + 2, dtype=np.int64) * HOUR_MS
+        offsets = np.searchsorted(timestamps, hour_starts, side="left").astype(HOURS_DTYPE)
+    else:
+        first_hour = 0
+        offsets = np.zeros(1, dtype=HOURS_DTYPE)
+    del timestamps
+
+    with open(column_file(tmp_dir, HOURS), 'wb') as file:
+        write_header(file, HOURS_DTYPE, len(offsets), first_hour)
+        offsets.tofile(file)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.rename(tmp_dir, store_dir)
+    return rows
+
+def open_column(path, dtype):
+    values, first_hour = read_header(path, dtype)
+    if values == 0:
+        # mmap cannot map an empty range
+        return np.zeros(0, dtype=dtype), first_hour
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(values,)), first_hour
+
+class ColumnStore:
+    def __init__(self, store_dir=STORE_DIR):
+        self.columns = {name: open_column(column_file(store_dir, name), dtype)[0] for name, dtype in COLUMNS.items()}
+        self.offsets, self.first_hour = open_column(column_file(store_dir, HOURS), HOURS_DTYPE)
+
+        self.rows = len(self.columns["timestamp"])
+        if any(len(column) != self.rows for column in self.columns.values()) or self.offsets[-1] != self.rows:
+            raise ValueError(f"Column files in {store_dir} disagree on the number of rows")
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def hour_offset(self, hour):
+        # First row at or after the start of this hour
+        i = min(max(hour - self.first_hour, 0), len(self.offsets) - 1)
+        return int(self.offsets[i])
+
+    def row_range(self, startDate, endDate):
+        # Rows with startDate <= timestamp <= endDate (epoch ms): whole hours come
+        # from the index, only the rows of the two boundary hours are searched
+        timestamps = self.columns["timestamp"]
+
+        hour = startDate // HOUR_MS
+        lo = self.hour_offset(hour)
+        lo += int(np.searchsorted(timestamps[lo:self.hour_offset(hour + 1)], startDate, side="left"))
+
+        hour = endDate // HOUR_MS
+        hi = self.hour_offset(hour)
+        hi += int(np.searchsorted(timestamps[hi:self.hour_offset(hour + 1)], endDate, side="right"))
+        return lo, max(lo, hi)
+
+    def color_counts(self, lo, hi):
+        counts = np.zeros(256, dtype=np.int64)
+        colors = self.columns["color_index"]
+        for start in range(lo, hi, CHUNK_ROWS):
+            counts += np.bincount(colors[start:min(start + CHUNK_ROWS, hi)], minlength=256)
+        return counts
+
+    def coordinate_counts(self, lo, hi):
+        # Placements per pixel, indexed by y * CANVAS_SIZE + x
+        counts = np.zeros(CANVAS_SIZE * CANVAS_SIZE, dtype=np.int64)
+        xs, ys = self.columns["x"], self.columns["y"]
+        for start in range(lo, hi, CHUNK_ROWS):
+            end = min(start + CHUNK_ROWS, hi)
+            keys = ys[start:end].astype(np.int32) * CANVAS_SIZE + xs[start:end]
+            counts += np.bincount(keys, minlength=counts.size)
+        return counts
+
+def top_placed(startDate, endDate, store_dir=STORE_DIR, rectangle_file=RECTANGLE_FILE, palette_file=PALETTE_FILE):
+    # Most placed color (hex) and coordinate ("x,y", or "x1,y1,x2,y2" for a
+    # moderator rectangle) in [startDate, endDate]
+    startDate = to_epoch_ms(startDate)
+    endDate = to_epoch_ms(endDate)
+
+    store = ColumnStore(store_dir)
+    lo, hi = store.row_range(startDate, endDate)
+    colors = store.color_counts(lo, hi)
+    coordinates = store.coordinate_counts(lo, hi)
+
+    # The rectangle file is small, read it whole
+    rectangles = pq.ParquetFile(rectangle_file).read().to_pydict()
+    in_window = [startDate <= ts <= endDate for ts in rectangles["timestamp"]]
+    rectangles = {name: [v for v, keep in zip(values, in_window) if keep] for name, values in rectangles.items()}
+    colors += np.bincount(np.asarray(rectangles["color_index"], dtype=np.int64), minlength=256)
+    boxes = Counter(zip(rectangles["x1"], rectangles["y1"], rectangles["x2"], rectangles["y2"]))
+
+    if not colors.any():
+        return None, None
+
+    palette = pq.ParquetFile(palette_file).read().to_pydict()
+    palette = dict(zip(palette["color_index"], palette["pixel_color"]))
+    color = palette[int(colors.argmax())]
+
+    pixel = int(coordinates.argmax())
+    box, box_count = boxes.most_common(1)[0] if boxes else (None, 0)
+    if box_count > coordinates[pixel]:
+        coordinate = ",".join(map(str, box))
+    else:
+        coordinate = f"{pixel % CANVAS_SIZE},{pixel // CANVAS_SIZE}"
+
+    return color, coordinate
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Most placed color and coordinate from the raw column store")
+    parser.add_argument("start", nargs="?", help="start date, 'YYYY-MM-DD HH'")
+    parser.add_argument("end", nargs="?", help="end date, 'YYYY-MM-DD HH'")
+    parser.add_argument("--export", action="store_true",
+                        help="(re)build the column store from the preprocessed parquet first")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="directory with the preprocessed parquet files")
+    options = parser.parse_args()
+
+    data_dir = os.path.abspath(options.data_dir)
+    store_dir = os.path.join(data_dir, 'rPlace_columns')
+
+    if options.export:
+        startTime = time.perf_counter_ns()
+        rows = export_columns(os.path.join(data_dir, 'rPlace.parquet'), store_dir)
+        elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+        print(f"Exported {rows} rows to {store_dir} in {elapsedTime_ms:.2f} ms")
+
+    if options.start is None and options.end is None:
+        if not options.export:
+            parser.print_usage()
+            sys.exit(1)
+        sys.exit(0)
+    if options.start is None or options.end is None:
+        parser.error("both start and end dates are required")
+
+    # Validate and start and end date
+    startDate, endDate = checkDates(options.start, options.end)
+
+    # Start the timer
+    startTime = time.perf_counter_ns()
+
+    color, coord = top_placed(startDate, endDate, store_dir, os.path.join(data_dir, 'rPlace_rectangles.parquet'),
+                              os.path.join(data_dir, 'palette.parquet'))
+
+    elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+
+    print(f"**Timeframe:** {startDate} to {endDate}")
+    print(f"**Execution Time:** {elapsedTime_ms:.4f} ms")
+    print(f"**Most Placed Color:** {color}")
+    print(f"**Most Placed Pixel Location:** {coord}")
@@ -0,0 +1,40 @@
+import sys
+from datetime import datetime, timezone
+from numbers import Integral
+
+# Window bounds are given on the command line to the hour, as 'YYYY-MM-DD HH'.
+# The fixed width format means validated bounds also compare correctly as strings.
+
+DATE_FORMAT = "%Y-%m-%d %H"
+MOMENT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def parse_hour(date):
+    return datetime.strptime(date, DATE_FORMAT)
+
+def to_epoch_ms(date):
+    # UTC milliseconds since the epoch, which is how rPlace.parquet stores timestamps.
+    # Takes epoch ms, a datetime, 'YYYY-MM-DD HH' or 'YYYY-MM-DD HH:MM:SS'.
+    if isinstance(date, Integral):
+        return int(date)
+    if not isinstance(date, datetime):
+        date = datetime.strptime(date, DATE_FORMAT if len(date) == 13 else MOMENT_FORMAT)
+    return int(date.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def checkDates(startDate, endDate):
+    try:
+        parse_hour(startDate)
+    except ValueError:
+        print(f"Error: '{startDate}' is not in the correct format 'YYYY-MM-DD HH'.")
+        sys.exit(1)
+
+    try:
+        parse_hour(endDate)
+    except ValueError:
+        print(f"Error: '{endDate}' is not in the correct format 'YYYY-MM-DD HH'.")
+        sys.exit(1)
+
+    if endDate <= startDate:
+        print("Error: End date must be after the start date.")
+        sys.exit(1)
+
+    return startDate, endDate
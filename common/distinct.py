@@ -0,0 +1,212 @@
+import numpy as np
+
+# Distinct counting for integer ids (user_id_numerical) in two modes:
+#
+#   exact   compressed bitmaps, laid out like roaring bitmaps: ids are split into
+#           chunks of 2^16 by their high bits and each chunk is stored as a sorted
+#           uint16 array while sparse or a 65536 bit bitmap once dense
+#   approx  HyperLogLog sketches, relative standard error 1.04 / sqrt(2^precision)
+#
+# Both kinds can be merged, so counts for different windows or regions can be
+# combined without rescanning.
+
+ARRAY_LIMIT = 4096  # chunks with more ids than this are stored as bitmaps
+HLL_PRECISION = 14
+
+def popcount(words):
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(words).sum())
+    return int(np.unpackbits(words.view(np.uint8)).sum())
+
+def to_bitmap(container):
+    if container.dtype == np.uint64:
+        return container
+    words = np.zeros(1024, dtype=np.uint64)
+    np.bitwise_or.at(words, container >> 6, np.left_shift(np.uint64(1), (container & 63).astype(np.uint64)))
+    return words
+
+def compact(words):
+    # Back to a sorted array when a chunk is sparse enough
+    if popcount(words) > ARRAY_LIMIT:
+        return words
+    bits = np.unpackbits(words.view(np.uint8), bitorder="little")
+    return np.flatnonzero(bits).astype(np.uint16)
+
+class Bitmap:
+    def __init__(self, values=None):
+        self.chunks = {}  # high 16 bits -> uint16 array or uint64[1024] bitmap
+        if values is not None:
+            self.add_many(values)
+
+    def add_many(self, values):
+        values = np.unique(np.asarray(values, dtype=np.uint32))
+        if len(values) == 0:
+            return
+        highs = values >> 16
+        keys, starts = np.unique(highs, return_index=True)
+        ends = np.append(starts[1:], len(values))
+
+        for key, start, end in zip(keys.tolist(), starts, ends):
+            low = (values[start:end] & 0xFFFF).astype(np.uint16)
+            container = self.chunks.get(key)
+            if container is None:
+                container = low
+            elif container.dtype == np.uint64:
+                container = container | to_bitmap(low)
+            else:
+                container = np.union1d(container, low)
+            if container.dtype == np.uint16 and len(container) > ARRAY_LIMIT:
+                container = to_bitmap(container)
+            self.chunks[key] = container
+
+    def __len__(self):
+        return sum(popcount(c) if c.dtype == np.uint64 else len(c) for c in self.chunks.values())
+
+    def __ior__(self, other):
+        for key, container in other.chunks.items():
+            mine = self.chunks.get(key)
+            if mine is None:
+                self.chunks[key] = container.copy()
+            elif mine.dtype == np.uint16 and container.dtype == np.uint16:
+                merged = np.union1d(mine, container)
+                self.chunks[key] = to_bitmap(merged) if len(merged) > ARRAY_LIMIT else merged
+            else:
+                self.chunks[key] = to_bitmap(mine) | to_bitmap(container)
+        return self
+
+    def __or__(self, other):
+        result = Bitmap()
+        result |= self
+        result |= other
+        return result
+
+    def __and__(self, other):
+        result = Bitmap()
+        for key in self.chunks.keys() & other.chunks.keys():
+            mine, theirs = self.chunks[key], other.chunks[key]
+            if mine.dtype == np.uint16 and theirs.dtype == np.uint16:
+                both = np.intersect1d(mine, theirs, assume_unique=True)
+            else:
+                both = compact(to_bitmap(mine) & to_bitmap(theirs))
+            if len(both):
+                result.chunks[key] = both
+        return result
+
+    def intersection_cardinality(self, other):
+        return len(self & other)
+
+    def count(self):
+        return len(self)
+
+def hash64(values):
+    # splitmix64 finalizer, spreads consecutive ids over the whole 64 bit range
+    x = np.asarray(values).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    return x
+
+def bit_length32(values):
+    # Exact for 32 bit values, frexp returns the exponent of the highest set bit
+    return np.frexp(values.astype(np.float64))[1]
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @property
+    def error_bound(self):
+        # Relative standard error of the estimate
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def add_many(self, values):
+        hashes = hash64(values)
+        if len(hashes) == 0:
+            return
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        rest = hashes << p
+
+        # rank = leading zeros of the remaining bits + 1, capped at 64 - p + 1
+        high = (rest >> np.uint64(32)).astype(np.uint32)
+        low = (rest & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+        zeros = np.where(high > 0, 32 - bit_length32(high), 64 - bit_length32(low))
+        rank = np.minimum(zeros, 64 - self.precision) + 1
+
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def __ior__(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def __or__(self, other):
+        result = HyperLogLog(self.precision)
+        result |= self
+        result |= other
+        return result
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+
+        # Small range correction (linear counting) while many registers are empty
+        empty = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and empty:
+            estimate = m * np.log(m / empty)
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+    def intersection_cardinality(self, other):
+        # Inclusion-exclusion, so the error is relative to the union
+        return max(self.count() + other.count() - (self | other).count(), 0)
+
+def new_sketch(mode="exact", precision=HLL_PRECISION):
+    if mode == "exact":
+        return Bitmap()
+    if mode == "approx":
+        return HyperLogLog(precision)
+    raise ValueError(f"Unknown distinct counting mode '{mode}', expected 'exact' or 'approx'")
+
+class DistinctCounter:
+    # Distinct ids per group, e.g. distinct users per color
+    def __init__(self, mode="exact", precision=HLL_PRECISION):
+        self.mode = mode
+        self.precision = precision
+        self.sketches = {}
+
+    def add(self, groups, values):
+        groups = np.asarray(groups)
+        values = np.asarray(values)
+        order = np.argsort(groups, kind="stable")
+        groups = groups[order]
+        values = values[order]
+        keys, starts = np.unique(groups, return_index=True)
+        ends = np.append(starts[1:], len(groups))
+
+        for key, start, end in zip(keys.tolist(), starts, ends):
+            if key not in self.sketches:
+                self.sketches[key] = new_sketch(self.mode, self.precision)
+            self.sketches[key].add_many(values[start:end])
+
+    def merge(self, other):
+        for key, sketch in other.sketches.items():
+            if key in self.sketches:
+                self.sketches[key] |= sketch
+            else:
+                self.sketches[key] = sketch
+        return self
+
+    def counts(self):
+        return {key: sketch.count() for key, sketch in self.sketches.items()}
+
+    @property
+    def error_bound(self):
+        return 0.0 if self.mode == "exact" else 1.04 / np.sqrt(1 << self.precision)
@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+import numpy as np
+import pyarrow.dataset as ds
+from matplotlib import image as mpimg
+
+# Placement density heatmaps. Each window is binned with np.bincount over packed
+# y * CANVAS_SIZE + x keys while streaming the parquet in batches, then written out
+# as a tile pyramid of PNGs ({window}/{zoom}/{tile_x}/{tile_y}.png): the highest
+# zoom is full resolution and every level below halves it by summing 2x2 blocks.
+# Windows are built in parallel, one per worker process.
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.dates import to_epoch_ms
+from common.rollup import DATA_DIR, PARQUET_FILE
+from common.tiles import CANVAS_SIZE
+
+HEATMAP_DIR = os.path.join(DATA_DIR, 'heatmaps')
+
+TILE_PIXELS = 256
+BATCH_ROWS = 1_000_000
+COLORMAP = "inferno"
+
+def heatmap_counts(parquet_file, startDate, endDate, include_end=False, batch_rows=BATCH_ROWS):
+    # Placements per pixel in [startDate, endDate) (epoch ms), or [startDate,
+    # endDate] with include_end, shape (y, x)
+    counts = np.zeros(CANVAS_SIZE * CANVAS_SIZE, dtype=np.int64)
+    dataset = ds.dataset(parquet_file, format="parquet")
+    end = ds.field("timestamp") <= endDate if include_end else ds.field("timestamp") < endDate
+    window = (ds.field("timestamp") >= startDate) & end
+
+    for batch in dataset.to_batches(columns=["x", "y"], filter=window, batch_size=batch_rows):
+        x = batch.column("x").to_numpy().astype(np.int64)
+        y = batch.column("y").to_numpy().astype(np.int64)
+        counts += np.bincount(y * CANVAS_SIZE + x, minlength=len(counts))
+
+    return counts.reshape(CANVAS_SIZE, CANVAS_SIZE)
+
+def pyramid_levels(counts):
+    # Full resolution first, padded to a power of two number of tiles
+    tiles = 1
+    while tiles * TILE_PIXELS < max(counts.shape):
+        tiles *= 2
+    size = tiles * TILE_PIXELS
+    level = np.zeros((size, size), dtype=np.int64)
+    level[:counts.shape[0], :counts.shape[1]] = counts
+
+    levels = [level]
+    while level.shape[0] > TILE_PIXELS:
+        half = level.shape[0] // 2
+        level = level.reshape(half, 2, half, 2).sum(axis=(1, 3))
+        levels.append(level)
+    return levels[::-1]  # zoom 0 is a single tile
+
+def write_pyramid(counts, out_dir):
+    for zoom, level in enumerate(pyramid_levels(counts)):
+        # Log scale so a few hot pixels do not wash out the rest of the canvas
+        scaled = np.log1p(level)
+        vmax = max(scaled.max(), 1)
+        tiles = level.shape[0] // TILE_PIXELS
+        for tile_x in range(tiles):
+            tile_dir = os.path.join(out_dir, str(zoom), str(tile_x))
+            os.makedirs(tile_dir, exist_ok=True)
+            for tile_y in range(tiles):
+                tile = scaled[tile_y * TILE_PIXELS:(tile_y + 1) * TILE_PIXELS,
+                              tile_x * TILE_PIXELS:(tile_x + 1) * TILE_PIXELS]
+                mpimg.imsave(os.path.join(tile_dir, f"{tile_y}.png"), tile, cmap=COLORMAP, vmin=0, vmax=vmax)
+
+def build_window(task):
+    parquet_file, out_dir, startDate, endDate, include_end = task
+    counts = heatmap_counts(parquet_file, to_epoch_ms(startDate), to_epoch_ms(endDate), include_end)
+    window_dir = os.path.join(out_dir, f"{startDate:%Y-%m-%d-%H}_{endDate:%Y-%m-%d-%H}")
+    write_pyramid(counts, window_dir)
+    return window_dir, int(counts.sum())
+
+def build_heatmaps(startDate, endDate, window_hours=1, parquet_file=PARQUET_FILE, out_dir=HEATMAP_DIR, workers=None):
+    # One pyramid per window_hours long window between startDate and endDate.
+    # Windows are half open so a placement on a boundary is counted once, only
+    # the last one includes endDate, like the other analyzers' windows.
+    tasks = []
+    windowStart = startDate
+    while windowStart < endDate:
+        windowEnd = min(windowStart + timedelta(hours=window_hours), endDate)
+        tasks.append((parquet_file, out_dir, windowStart, windowEnd, windowEnd == endDate))
+        windowStart = windowEnd
+
+    with Pool(workers) as pool:
+        return pool.map(build_window, tasks)
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("Usage: heatmap.py <start_date> <end_date> [hours_per_window]")
+        sys.exit(1)
+
+    try:
+        startDate = datetime.strptime(sys.argv[1], "%Y-%m-%d %H")
+        endDate = datetime.strptime(sys.argv[2], "%Y-%m-%d %H")
+    except ValueError:
+        print("Error: dates must be in the format 'YYYY-MM-DD HH'.")
+        sys.exit(1)
+
+    if endDate <= startDate:
+        print("Error: End date must be after the start date.")
+        sys.exit(1)
+
+    window_hours = int(sys.argv[3]) if len(sys.argv) == 4 else 1
+
+    startTime = time.perf_counter_ns()
+
+    results = build_heatmaps(startDate, endDate, window_hours)
+
+    elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+
+    for window_dir, placements in results:
+        print(f"{window_dir}: {placements} placements")
+    print(f"**Execution Time:** {elapsedTime_ms:.4f} ms")
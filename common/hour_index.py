@@ -0,0 +1,118 @@
+import io
+import json
+import os
+import sys
+from datetime import datetime
+
+# Sidecar index for the raw canvas history csv. For every hour seen in the file it
+# records the byte offset of the first row of that hour, the offset just past the
+# last row of that hour and how many rows it has. The file is mostly (not strictly)
+# ordered by time, so an hour can be spread out; keeping both ends means the span
+# we hand back always covers every row of the requested hours.
+
+HOUR_FORMAT = "%Y-%m-%d %H"
+
+def index_file_for(csv_file):
+    return csv_file + '.hourindex.json'
+
+def source_fingerprint(csv_file):
+    stat = os.stat(csv_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def build_index(csv_file, index_file=None):
+    index_file = index_file or index_file_for(csv_file)
+    hours = {}
+
+    with open(csv_file, 'rb', buffering=16 * 1024 * 1024) as file:
+        offset = len(file.readline())  # skip the header
+
+        for line in file:
+            hour = line[:13].decode()
+            entry = hours.get(hour)
+            if entry is None:
+                hours[hour] = [offset, offset + len(line), 1]
+            else:
+                entry[1] = offset + len(line)
+                entry[2] += 1
+            offset += len(line)
+
+    with open(index_file, 'w') as file:
+        json.dump({"source": source_fingerprint(csv_file), "hours": hours}, file)
+
+    return hours
+
+def load_index(csv_file, index_file=None):
+    # Returns None when there is no index or it was built from a different file
+    index_file = index_file or index_file_for(csv_file)
+    if not os.path.exists(index_file):
+        return None
+
+    with open(index_file) as file:
+        index = json.load(file)
+
+    if index["source"] != source_fingerprint(csv_file):
+        return None
+
+    return index["hours"]
+
+def window_span(hours, startDate, endDate):
+    # Byte span covering every row stamped between the start and end hour (inclusive)
+    if isinstance(startDate, datetime):
+        startDate = startDate.strftime(HOUR_FORMAT)
+    if isinstance(endDate, datetime):
+        endDate = endDate.strftime(HOUR_FORMAT)
+
+    entries = [entry for hour, entry in hours.items() if startDate <= hour <= endDate]
+    if not entries:
+        return (0, 0)
+
+    return (min(entry[0] for entry in entries), max(entry[1] for entry in entries))
+
+class SpanReader(io.RawIOBase):
+    # Reads the csv header followed by only the bytes inside the span, so
+    # readers that expect a whole csv file can be pointed at part of one.
+    def __init__(self, csv_file, span):
+        self.file = open(csv_file, 'rb')
+        self.header = self.file.readline()
+        self.file.seek(span[0])
+        self.remaining = span[1] - span[0]
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.header:
+            n = min(len(buffer), len(self.header))
+            buffer[:n] = self.header[:n]
+            self.header = self.header[n:]
+            return n
+
+        n = min(len(buffer), self.remaining)
+        if n <= 0:
+            return 0
+        data = self.file.read(n)
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+def open_span(csv_file, span):
+    return io.BufferedReader(SpanReader(csv_file, span), buffer_size=16 * 1024 * 1024)
+
+def find_span(csv_file, startDate, endDate):
+    # Span for the window if a current index exists, otherwise None (scan everything)
+    hours = load_index(csv_file)
+    if hours is None:
+        return None
+    return window_span(hours, startDate, endDate)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: hour_index.py <csv_file>")
+        sys.exit(1)
+
+    hours = build_index(sys.argv[1])
+    print(f"Indexed {len(hours)} hours, written to {index_file_for(sys.argv[1])}")
@@ -0,0 +1,47 @@
+from functools import lru_cache
+import numpy as np
+import webcolors
+
+# Color naming shared by the analyzers. The CSS3 name table is built once, the
+# nearest name search is vectorized over it, and results are cached per color, so
+# naming a column of colors costs one lookup per distinct color.
+
+# The 2022 r/place palette, in the order used for color_index
+RPLACE_PALETTE = [
+    "#6D001A", "#BE0039", "#FF4500", "#FFA800", "#FFD635", "#FFF8B8", "#00A368", "#00CC78",
+    "#7EED56", "#00756F", "#009EAA", "#00CCC0", "#2450A4", "#3690EA", "#51E9F4", "#493AC1",
+    "#6A5CFF", "#94B3FF", "#811E9F", "#B44AC0", "#E4ABFF", "#DE107F", "#FF3881", "#FF99AA",
+    "#6D482F", "#9C6926", "#FFB470", "#000000", "#515252", "#898D90", "#D4D7D9", "#FFFFFF",
+]
+
+@lru_cache(maxsize=None)
+def css3_table():
+    names = list(webcolors.names("css3"))
+    rgb = np.array([tuple(webcolors.name_to_rgb(name)) for name in names], dtype=np.int64)
+    return names, rgb
+
+@lru_cache(maxsize=None)
+def hex_to_name(hex):
+    try:
+        return webcolors.hex_to_name(hex)
+    except ValueError:
+        return hex_to_closest_name(hex)
+
+def hex_to_closest_name(hex):
+    # Closest CSS3 color by Euclidean distance in RGB
+    names, rgb = css3_table()
+    target = np.array(tuple(webcolors.hex_to_rgb(hex)), dtype=np.int64)
+    return names[int(np.argmin(((rgb - target) ** 2).sum(axis=1)))]
+
+@lru_cache(maxsize=None)
+def palette_names(palette=tuple(RPLACE_PALETTE)):
+    return np.array([hex_to_name(hex) for hex in palette], dtype=object)
+
+def names_for(colors, palette=RPLACE_PALETTE):
+    # Names for a whole array/Series of hex strings or integer palette indexes
+    colors = np.asarray(colors)
+    if np.issubdtype(colors.dtype, np.integer):
+        return palette_names(tuple(palette))[colors]
+
+    unique, inverse = np.unique(colors.astype(str), return_inverse=True)
+    return np.array([hex_to_name(hex) for hex in unique], dtype=object)[inverse]
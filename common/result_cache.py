@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+
+# Disk cache for query results. An entry is keyed on the query id, the window and
+# any parameters of the query together with the paths of the files it read, and
+# remembers the fingerprint (size, mtime) each of those files had when it was
+# computed. Whenever a file is seen with a different fingerprint every entry
+# computed from the old version of it is dropped, so results never outlive their
+# data. The cache is capped at max_bytes and evicts the least recently used
+# entries first.
+#
+#   result_cache/index.json       key -> query, source fingerprints, size, last use
+#   result_cache/<key>.pickle     the result itself
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.hour_index import source_fingerprint
+from common.rollup import DATA_DIR
+
+CACHE_DIR = os.path.join(DATA_DIR, 'result_cache')
+MAX_BYTES = 256 * 1024 * 1024
+
+def fingerprint(path):
+    return source_fingerprint(path) if os.path.exists(path) else None
+
+class ResultCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.index = self.load_index() if enabled else {}
+
+    def index_file(self):
+        return os.path.join(self.cache_dir, 'index.json')
+
+    def entry_file(self, key):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def load_index(self):
+        try:
+            with open(self.index_file()) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_file = self.index_file() + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(self.index, file)
+        os.replace(tmp_file, self.index_file())
+
+    def key(self, query, sources, window, params):
+        payload = json.dumps({"query": query, "sources": sorted(sources), "window": window, "params": params},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def remove(self, key):
+        self.index.pop(key, None)
+        try:
+            os.remove(self.entry_file(key))
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, fingerprints):
+        # Drop every entry computed from another version of one of these files
+        stale = [key for key, entry in self.index.items()
+                 if any(path in fingerprints and fingerprints[path] != seen
+                        for path, seen in entry["sources"].items())]
+        for key in stale:
+            self.remove(key)
+        self.invalidated += len(stale)
+        return bool(stale)
+
+    def evict(self):
+        total = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda key: self.index[key]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]["size"]
+            self.remove(key)
+
+    def cached(self, query, sources, window, params, compute):
+        # Result of compute() for this query, from disk if it was computed before
+        # from the same versions of the source files
+        if not self.enabled:
+            return compute()
+
+        fingerprints = {os.path.abspath(path): fingerprint(path) for path in sources}
+        changed = self.invalidate(fingerprints)
+        key = self.key(query, list(fingerprints), window, params)
+
+        if key in self.index:
+            try:
+                with open(self.entry_file(key), 'rb') as file:
+                    value = pickle.load(file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                self.remove(key)
+            else:
+                self.hits += 1
+                self.index[key]["last_used"] = time.time()
+                self.save_index()
+                return value
+
+        self.misses += 1
+        value = compute()
+
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) <= self.max_bytes:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_file = self.entry_file(key) + '.tmp'
+            with open(tmp_file, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_file, self.entry_file(key))
+            self.index[key] = {"query": query, "sources": fingerprints, "size": len(data), "last_used": time.time()}
+            self.evict()
+            self.save_index()
+        elif changed:
+            self.save_index()
+
+        return value
+
+    def report(self):
+        if not self.enabled:
+            return "**Result Cache:** disabled"
+        line = f"**Result Cache:** {self.hits} hits, {self.misses} misses"
+        if self.invalidated:
+            line += f", {self.invalidated} stale entries dropped"
+        return line
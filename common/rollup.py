@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import duckdb
+
+# Hourly rollup cube over the preprocessed dataset. Windows can only be given to
+# the hour, so the most placed color/coordinate over any window is the sum of the
+# per hour counts for [start, end) plus the placements stamped exactly at `end`
+# (the analyzers treat the end bound as inclusive).
+#
+#   hour_color.parquet  (hour, color_index, n)
+#   hour_coord.parquet  (hour, x, y, x2, y2, n)   x2/y2 set for moderator rectangles
+#   hour_user.parquet   (hour, user_id, n)
+#
+# hour is the number of whole hours since the epoch (UTC).
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+from common.dates import to_epoch_ms
+
+DATA_DIR = os.path.join(REPO_DIR, 'week3')
+PARQUET_FILE = os.path.join(DATA_DIR, 'rPlace.parquet')
+PALETTE_FILE = os.path.join(DATA_DIR, 'palette.parquet')
+RECTANGLE_FILE = os.path.join(DATA_DIR, 'rPlace_rectangles.parquet')
+ROLLUP_DIR = os.path.join(DATA_DIR, 'rollup')
+
+HOUR_MS = 3_600_000
+
+def events_sql(parquet_file, rectangle_file):
+    # Pixel placements and rectangle edits as one relation
+    return f"""(
+        SELECT timestamp, user_id_numerical, color_index, x, y,
+               CAST(NULL AS SMALLINT) AS x2, CAST(NULL AS SMALLINT) AS y2
+        FROM read_parquet('{parquet_file}')
+        UNION ALL
+        SELECT timestamp, user_id_numerical, color_index, x1 AS x, y1 AS y, x2, y2
+        FROM read_parquet('{rectangle_file}')
+    )"""
+
+def build_rollup(parquet_file=PARQUET_FILE, rectangle_file=RECTANGLE_FILE, rollup_dir=ROLLUP_DIR):
+    os.makedirs(rollup_dir, exist_ok=True)
+    con = duckdb.connect()
+    con.execute(f"CREATE TEMP VIEW events AS SELECT *, CAST(timestamp // {HOUR_MS} AS INTEGER) AS hour FROM {events_sql(parquet_file, rectangle_file)}")
+
+    cubes = {
+        "hour_color": "color_index",
+        "hour_coord": "x, y, x2, y2",
+        "hour_user": "user_id_numerical AS user_id",
+    }
+    for name, columns in cubes.items():
+        group = columns.replace(" AS user_id", "")
+        con.execute(f"""
+                    COPY (
+                        SELECT hour, {columns}, CAST(COUNT(*) AS UINTEGER) AS n
+                        FROM events
+                        GROUP BY hour, {group}
+                        ORDER BY hour
+                    )
+                    TO '{os.path.join(rollup_dir, name + '.parquet')}' (FORMAT parquet, COMPRESSION zstd)
+                    """)
+    con.close()
+
+def query_rollup(startDate, endDate, rollup_dir=ROLLUP_DIR, parquet_file=PARQUET_FILE,
+                 rectangle_file=RECTANGLE_FILE, palette_file=PALETTE_FILE):
+    # Most placed color (hex) and coordinate ("x,y") in [startDate, endDate]
+    startDate = to_epoch_ms(startDate)
+    endDate = to_epoch_ms(endDate)
+    startHour = startDate // HOUR_MS
+    endHour = endDate // HOUR_MS
+
+    con = duckdb.connect()
+    con.execute(f"""
+                CREATE TEMP VIEW boundary AS
+                SELECT * FROM {events_sql(parquet_file, rectangle_file)}
+                WHERE timestamp = {endDate}
+                """)
+
+    color = con.execute(f"""
+                        WITH counts AS (
+                            SELECT color_index, n
+                            FROM read_parquet('{os.path.join(rollup_dir, 'hour_color.parquet')}')
+                            WHERE hour >= {startHour} AND hour < {endHour}
+                            UNION ALL
+                            SELECT color_index, 1 FROM boundary
+                        )
+                        SELECT palette.pixel_color
+                        FROM counts
+                        JOIN read_parquet('{palette_file}') palette USING (color_index)
+                        GROUP BY palette.pixel_color
+                        ORDER BY SUM(n) DESC
+                        LIMIT 1
+                        """).fetchall()
+
+    coord = con.execute(f"""
+                        WITH counts AS (
+                            SELECT x, y, x2, y2, n
+                            FROM read_parquet('{os.path.join(rollup_dir, 'hour_coord.parquet')}')
+                            WHERE hour >= {startHour} AND hour < {endHour}
+                            UNION ALL
+                            SELECT x, y, x2, y2, 1 FROM boundary
+                        )
+                        SELECT
+                            CASE WHEN x2 IS NULL THEN x || ',' || y
+                            ELSE x || ',' || y || ',' || x2 || ',' || y2 END
+                        FROM counts
+                        GROUP BY x, y, x2, y2
+                        ORDER BY SUM(n) DESC
+                        LIMIT 1
+                        """).fetchall()
+    con.close()
+
+    return (color[0][0] if color else None), (coord[0][0] if coord else None)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 1:
+        print("Usage: rollup.py")
+        sys.exit(1)
+
+    startTime = time.perf_counter_ns()
+
+    build_rollup()
+
+    elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+    print(f"Built hourly rollups in {ROLLUP_DIR} in {elapsedTime_ms:.2f} ms")
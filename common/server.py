@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import duckdb
+import pyarrow.parquet as pq
+
+# Long running analysis server. It pays the fixed costs once: the imports, one
+# DuckDB database with the palette loaded and views over the parquet files, and
+# DuckDB's parquet footer cache. It then answers the week1-week5 analyses over a
+# local HTTP API. Every request runs on its own thread with its own cursor on the
+# shared database, so requests run concurrently.
+#
+#   GET /health
+#   GET /top?start=..&end=..                       most placed color and coordinate
+#   GET /color_ranking?start=..&end=..[&mode=approx]
+#   GET /sessions?start=..&end=..[&gap=seconds]
+#   GET /percentiles?start=..&end=..[&q=0.5,0.9]
+#   GET /first_time_users?start=..&end=..
+#   GET /regions[?config=regions.json][&mode=approx]
+#
+# start and end are 'YYYY-MM-DD HH'. Responses are JSON: {"analysis", "result",
+# "elapsed_ms"}, or {"error"} with a 4xx/5xx status. client.py is the command line
+# front end.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+from common.analyze import COORDINATE_SQL, load_script
+from common.aggregates import run_duckdb
+from common.dates import parse_hour, to_epoch_ms
+from common.rollup import DATA_DIR, events_sql
+
+HOST = '127.0.0.1'
+PORT = 8369
+REGIONS_FILE = os.path.join(REPO_DIR, 'week5', 'regions.json')
+
+class Analyses:
+    def __init__(self, data_dir=DATA_DIR):
+        self.parquet_file = os.path.join(data_dir, 'rPlace.parquet')
+        self.rectangle_file = os.path.join(data_dir, 'rPlace_rectangles.parquet')
+        self.palette_file = os.path.join(data_dir, 'palette.parquet')
+        self.first_seen_file = os.path.join(data_dir, 'user_first_seen.parquet')
+        self.tile_file = os.path.join(data_dir, 'rPlace_tiles.parquet')
+        self.tile_index_file = os.path.join(data_dir, 'tile_index.parquet')
+
+        # The analysis modules, imported once
+        self.parquet_analyzer = load_script('week3', 'parquet_analyzer')
+        self.sessionizer = load_script('week3', 'sessionizer')
+        self.histograms = load_script('week3', 'percentiles')
+        self.region_analyze = load_script('week5', 'region_analyze')
+
+        self.con = duckdb.connect()
+        self.con.execute("SET parquet_metadata_cache = true")
+        self.con.execute(f"CREATE TABLE palette AS SELECT * FROM read_parquet('{self.palette_file}')")
+        self.con.execute(f"CREATE VIEW events AS SELECT * FROM {events_sql(self.parquet_file, self.rectangle_file)}")
+        self.palette = dict(self.con.execute("SELECT color_index, pixel_color FROM palette").fetchall())
+        self.metadata = pq.ParquetFile(self.parquet_file).metadata
+        # Warm the footer cache
+        self.con.execute(f"SELECT COUNT(*) FROM read_parquet('{self.parquet_file}')").fetchall()
+
+        # Region analyses replay the whole tile file, so only one runs at a time
+        self.region_lock = threading.Lock()
+
+    def window(self, params):
+        if "start" not in params or "end" not in params:
+            raise ValueError("start and end are required")
+        parse_hour(params["start"])
+        parse_hour(params["end"])
+        if params["end"] <= params["start"]:
+            raise ValueError("End date must be after the start date.")
+        return to_epoch_ms(params["start"]), to_epoch_ms(params["end"])
+
+    def health(self, con, params):
+        return {"rows": self.metadata.num_rows, "row_groups": self.metadata.num_row_groups,
+                "colors": len(self.palette)}
+
+    def top(self, con, params):
+        startDate, endDate = self.window(params)
+        result = run_duckdb(con, "events JOIN palette USING (color_index)",
+                            f"timestamp BETWEEN {startDate} AND {endDate}", ["top_color", "top_coordinate"],
+                            columns={"pixel_color": "palette.pixel_color", "coordinate": COORDINATE_SQL})
+        return {"color": result["top_color"], "coordinate": result["top_coordinate"]}
+
+    def color_ranking(self, con, params):
+        startDate, endDate = self.window(params)
+        mode = params.get("mode", "exact")
+        counter = self.parquet_analyzer.distinct_users_by_color(con, self.parquet_file, startDate, endDate, mode)
+        ranking = sorted(((self.palette[color], count) for color, count in counter.counts().items()),
+                         key=lambda res: res[1], reverse=True)
+        return {"mode": mode, "error_bound": counter.error_bound, "ranking": ranking}
+
+    def sessions(self, con, params):
+        startDate, endDate = self.window(params)
+        gap = float(params.get("gap", self.sessionizer.GAP_SECONDS))
+        return self.sessionizer.session_stats(con, self.parquet_file, startDate, endDate, gap)
+
+    def percentiles(self, con, params):
+        startDate, endDate = self.window(params)
+        q = [float(value) for value in params["q"].split(",")] if "q" in params else self.histograms.PERCENTILES
+        values = self.histograms.window_percentiles(con, self.parquet_file, startDate, endDate, q)
+        return dict(zip(map(str, q), values))
+
+    def first_time_users(self, con, params):
+        startDate, endDate = self.window(params)
+        count = con.execute(f"""
+                            SELECT COUNT(*) FROM read_parquet('{self.first_seen_file}')
+                            WHERE first_ts BETWEEN {startDate} AND {endDate}
+                            """).fetchall()[0][0]
+        return {"first_time_users": count}
+
+    def regions(self, con, params):
+        regions = self.region_analyze.load_regions(params.get("config", REGIONS_FILE))
+        with self.region_lock:
+            overlap, colors = self.region_analyze.analyze_regions(
+                regions, self.parquet_file, self.tile_file, self.tile_index_file, params.get("mode", "exact"))
+
+        results = []
+        for i, region in enumerate(regions):
+            top = [int(c) for c in colors[i].argsort()[::-1][:3] if colors[i][c]]
+            results.append({"name": region["name"], "distinct_users": int(overlap[i, i]),
+                            "top_colors": [(self.palette[c], int(colors[i][c])) for c in top]})
+        return {"regions": results, "overlap": overlap.tolist()}
+
+ANALYSES = ["health", "top", "color_ranking", "sessions", "percentiles", "first_time_users", "regions"]
+
+def to_json(value):
+    # numpy scalars and arrays
+    return value.tolist() if hasattr(value, "tolist") else str(value)
+
+class Handler(BaseHTTPRequestHandler):
+    def reply(self, status, body):
+        data = json.dumps(body, default=to_json).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        name = url.path.strip("/")
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if name not in ANALYSES:
+            self.reply(404, {"error": f"Unknown analysis '{name}'"})
+            return
+
+        startTime = time.perf_counter_ns()
+        con = self.server.analyses.con.cursor()
+        try:
+            result = getattr(self.server.analyses, name)(con, params)
+        except (ValueError, KeyError, OSError) as error:
+            self.reply(400, {"error": str(error)})
+            return
+        except duckdb.Error as error:
+            self.reply(500, {"error": str(error)})
+            return
+        except Exception as error:
+            self.reply(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        finally:
+            con.close()
+
+        elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+        self.reply(200, {"analysis": name, "result": result, "elapsed_ms": elapsedTime_ms})
+
+def serve(host=HOST, port=PORT, data_dir=DATA_DIR):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.analyses = Analyses(data_dir)
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the r/place analyses over local HTTP")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--data-dir", default=DATA_DIR, help="directory with the preprocessed parquet files")
+    options = parser.parse_args()
+
+    startTime = time.perf_counter_ns()
+    server = serve(options.host, options.port, os.path.abspath(options.data_dir))
+    elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+
+    print(f"Loaded {options.data_dir} in {elapsedTime_ms:.2f} ms, listening on http://{options.host}:{options.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
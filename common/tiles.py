@@ -0,0 +1,76 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Spatial layout of the preprocessed dataset. The canvas is cut into square tiles
+# and rows are ordered by the Z-order (Morton) code of their tile, so nearby tiles
+# end up in the same or neighbouring row groups. The tile index lists, for every
+# tile, the row groups of the tile ordered file that contain it, so a rectangle
+# query only reads the row groups overlapping the rectangle.
+
+CANVAS_SIZE = 2000  # the canvas is CANVAS_SIZE x CANVAS_SIZE pixels
+TILE_SIZE = 32
+TILE_BITS = 11  # enough for tile coordinates of the canvas at any tile size
+
+def morton(tile_x, tile_y):
+    # Interleave the bits of tile_x (even positions) and tile_y (odd positions)
+    tile_x = np.asarray(tile_x, dtype=np.int64)
+    tile_y = np.asarray(tile_y, dtype=np.int64)
+    code = np.zeros(np.broadcast(tile_x, tile_y).shape, dtype=np.int64)
+    for bit in range(TILE_BITS):
+        code |= ((tile_x >> bit) & 1) << (2 * bit)
+        code |= ((tile_y >> bit) & 1) << (2 * bit + 1)
+    return code
+
+def morton_sql(x, y, tile_size=TILE_SIZE):
+    # The same code as a SQL expression over pixel columns x and y
+    tile_x = f"({x} // {tile_size})"
+    tile_y = f"({y} // {tile_size})"
+    terms = []
+    for bit in range(TILE_BITS):
+        terms.append(f"((({tile_x} >> {bit}) & 1) << {2 * bit})")
+        terms.append(f"((({tile_y} >> {bit}) & 1) << {2 * bit + 1})")
+    return "CAST(" + " | ".join(terms) + " AS INTEGER)"
+
+def tiles_for_box(x1, y1, x2, y2, tile_size=TILE_SIZE):
+    # Morton codes of every tile overlapping the inclusive pixel box
+    tile_x, tile_y = np.meshgrid(np.arange(x1 // tile_size, x2 // tile_size + 1),
+                                 np.arange(y1 // tile_size, y2 // tile_size + 1))
+    return morton(tile_x.ravel(), tile_y.ravel())
+
+def build_tile_index(tile_file, index_file, tile_size=TILE_SIZE):
+    # Exact tile -> row group pairs, read from the tile column only
+    parquet = pq.ParquetFile(tile_file)
+    tiles = []
+    row_groups = []
+    for i in range(parquet.metadata.num_row_groups):
+        present = np.unique(parquet.read_row_group(i, columns=["tile"]).column("tile").to_numpy())
+        tiles.append(present)
+        row_groups.append(np.full(len(present), i, dtype=np.int32))
+
+    table = pa.table({
+        "tile": np.concatenate(tiles).astype(np.int32),
+        "row_group": np.concatenate(row_groups),
+    })
+    table = table.replace_schema_metadata({"tile_size": str(tile_size)})
+    pq.write_table(table, index_file)
+
+def index_tile_size(index_file):
+    return int(pq.read_schema(index_file).metadata[b"tile_size"])
+
+def tiles_for_boxes(index_file, boxes):
+    # Tile codes overlapping any of the boxes, at the tile size the index was built with
+    tile_size = index_tile_size(index_file)
+    return sorted(set().union(*(tiles_for_box(*box, tile_size).tolist() for box in boxes)))
+
+def row_groups_for_box(index_file, x1, y1, x2, y2):
+    index = pq.read_table(index_file)
+    wanted = tiles_for_box(x1, y1, x2, y2, index_tile_size(index_file))
+    mask = np.isin(index.column("tile").to_numpy(), wanted)
+    return sorted(set(index.column("row_group").to_numpy()[mask].tolist()))
+
+def read_boxes(tile_file, index_file, boxes, columns=None):
+    # Rows of the tile ordered file from the row groups overlapping any of the boxes
+    # ((x1, y1, x2, y2) each). Rows outside the boxes still need to be filtered out.
+    row_groups = sorted(set().union(*(row_groups_for_box(index_file, *box) for box in boxes)))
+    return pq.ParquetFile(tile_file).read_row_groups(row_groups, columns=columns)
@@ -1,30 +1,28 @@
 import csv
+import io
+import os
 import sys
 from datetime import datetime
 import time
 from collections import Counter
+from multiprocessing import Pool
 
-def checkDates(startDate, endDate):
-    try:
-        startDate = datetime.strptime(startDate, "%Y-%m-%d %H")
-    except ValueError:
-        print(f"Error: '{startDate}' is not in the correct format 'YYYY-MM-DD HH'.")
-        sys.exit(1)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.dates import checkDates, parse_hour
+from common.hour_index import find_span, open_span
 
-    try:
-        endDate = datetime.strptime(endDate, "%Y-%m-%d %H")
-    except ValueError:
-        print(f"Error: '{endDate}' is not in the correct format 'YYYY-MM-DD HH'.")
-        sys.exit(1)
+CSV_FILE = '../2022_place_canvas_history.csv'
+CHUNK_SIZE = 64 * 1024 * 1024  # bytes of csv handed to a worker at a time
 
-    if endDate <= startDate:
-        print("Error: End date must be after the start date.")
-        sys.exit(1) 
-    
-    return startDate, endDate
+def openWindow(csv_file, startDate, endDate):
+    # Only read the part of the file the hour index says can hold the window
+    span = find_span(csv_file, startDate, endDate)
+    if span is None:
+        return open(csv_file, 'r')
+    return io.TextIOWrapper(open_span(csv_file, span))
 
-def main(startDate, endDate):
-    with open('../2022_place_canvas_history.csv', 'r') as file:
+def main(startDate, endDate, csv_file=CSV_FILE):
+    with openWindow(csv_file, startDate, endDate) as file:
         colorCounter = Counter()
         coordCounter = Counter()
 
@@ -52,22 +50,110 @@ def main(startDate, endDate):
 
         return mostPlacedColor, mostPlacedCoord    
 
+def inWindow(raw_time, startStr, endStr):
+    # Timestamps are fixed width 'YYYY-MM-DD HH:MM:SS[.fff] UTC', so the first 19
+    # characters can be compared as strings against the window bounds. A fractional
+    # part only matters when the seconds land exactly on the end bound.
+    second = raw_time[:19]
+    if second < startStr or second > endStr:
+        return False
+    if second == endStr:
+        return raw_time[19:20] != "."
+    return True
+
+def splitByteRanges(csv_file, chunkSize=CHUNK_SIZE, span=None):
+    # Cut the file (or the indexed span of it) into ranges that each start at the
+    # beginning of a line
+    with open(csv_file, 'rb') as file:
+        header = file.readline()
+        start, stop = span if span is not None else (file.tell(), os.path.getsize(csv_file))
+        bounds = [start]
+        while bounds[-1] < stop:
+            file.seek(bounds[-1] + chunkSize)
+            file.readline()  # move forward to the next line start
+            bounds.append(min(file.tell(), stop))
+
+    return header.decode(), list(zip(bounds[:-1], bounds[1:]))
+
+def scanRange(task):
+    csv_file, start, end, startStr, endStr, timeIdx, pixel_colorIdx, coordIdx = task
+    colorCounter = Counter()
+    coordCounter = Counter()
+
+    with open(csv_file, 'rb') as file:
+        file.seek(start)
+        lines = file.read(end - start).decode().splitlines()
+
+    if timeIdx == 0:
+        # Timestamp leads the row, so filter on the raw line before parsing it
+        lines = [line for line in lines if inWindow(line, startStr, endStr)]
+        rows = csv.reader(lines)
+    else:
+        rows = (row for row in csv.reader(lines) if inWindow(row[timeIdx].strip(), startStr, endStr))
+
+    for row in rows:
+        colorCounter[row[pixel_colorIdx]] += 1
+        coordCounter[row[coordIdx]] += 1
+
+    return colorCounter, coordCounter
+
+def parallelMain(startDate, endDate, workers=None, csv_file=CSV_FILE):
+    startStr = startDate.strftime("%Y-%m-%d %H:%M:%S")
+    endStr = endDate.strftime("%Y-%m-%d %H:%M:%S")
+
+    header, ranges = splitByteRanges(csv_file, span=find_span(csv_file, startDate, endDate))
+    headers = next(csv.reader([header]))
+    timeIdx = headers.index('timestamp')
+    pixel_colorIdx = headers.index('pixel_color')
+    coordIdx = headers.index('coordinate')
+
+    tasks = [(csv_file, start, end, startStr, endStr, timeIdx, pixel_colorIdx, coordIdx)
+             for start, end in ranges]
+
+    colorCounter = Counter()
+    coordCounter = Counter()
+
+    # imap keeps the ranges in file order, so ties in most_common break the same
+    # way they do in the single-threaded scan
+    with Pool(workers) as pool:
+        for partColors, partCoords in pool.imap(scanRange, tasks):
+            colorCounter.update(partColors)
+            coordCounter.update(partCoords)
+
+    mostPlacedColor, colorCount = colorCounter.most_common(1)[0]
+    mostPlacedCoord, coordCount = coordCounter.most_common(1)[0]
+
+    return mostPlacedColor, mostPlacedCoord
+
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: analyzer.py <start_date> <end_date>")
+    rollup = "--rollup" in sys.argv
+    argv = [arg for arg in sys.argv if arg != "--rollup"]
+
+    if len(argv) < 3 or len(argv) > 5 or (len(argv) > 3 and argv[3] != "--parallel"):
+        print("Usage: analyzer.py <start_date> <end_date> [--parallel [workers]] [--rollup]")
         sys.exit(1)
 
     # Extract command-line arguments
-    start_date_str = sys.argv[1]
-    end_date_str = sys.argv[2]
+    start_date_str = argv[1]
+    end_date_str = argv[2]
+    parallel = len(argv) > 3
+    workers = int(argv[4]) if len(argv) > 4 else None
 
     # Validate and start and end date
     startDate, endDate = checkDates(start_date_str, end_date_str)
+    startDate, endDate = parse_hour(startDate), parse_hour(endDate)
     
     # Start the timer
     startTime = time.perf_counter_ns()
 
-    color, coord = main(startDate, endDate)
+    if rollup:
+        # Answer from the hourly rollups instead of scanning the csv
+        from common.rollup import query_rollup
+        color, coord = query_rollup(startDate, endDate)
+    elif parallel:
+        color, coord = parallelMain(startDate, endDate, workers)
+    else:
+        color, coord = main(startDate, endDate)
 
     # End the timer
     endTime = time.perf_counter_ns()
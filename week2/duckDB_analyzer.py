@@ -1,84 +1,94 @@
+import os
 import sys
 from datetime import datetime
 import time
 from collections import Counter
 import duckdb
+import pyarrow as pa
+import pyarrow.csv as pv
 
-def checkDates(startDate, endDate):
-    try:
-        datetime.strptime(startDate, "%Y-%m-%d %H")
-    except ValueError:
-        print(f"Error: '{startDate}' is not in the correct format 'YYYY-MM-DD HH'.")
-        sys.exit(1)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.dates import checkDates
+from common.aggregates import run_duckdb
+from common.hour_index import find_span, open_span
+from common.result_cache import ResultCache
+from common.rollup import query_rollup
+from duckDB_ingest import COORDINATE_EXPR, DB_FILE, ingest
 
-    try:
-        datetime.strptime(endDate, "%Y-%m-%d %H")
-    except ValueError:
-        print(f"Error: '{endDate}' is not in the correct format 'YYYY-MM-DD HH'.")
-        sys.exit(1)
+CSV_FILE = '../../2022_place_canvas_history.csv'
 
-    if endDate <= startDate:
-        print("Error: End date must be after the start date.")
-        sys.exit(1) 
-    
-    return startDate, endDate
+def duckDB(startDate, endDate, csv_file=CSV_FILE):
+    span = find_span(csv_file, startDate, endDate)
 
-def duckDB(startDate, endDate):
     # Format start and end date to wort with query
     startDate = datetime.strptime(startDate, "%Y-%m-%d %H").strftime("%Y-%m-%d %H:%M:%S")
     endDate = datetime.strptime(endDate, "%Y-%m-%d %H").strftime("%Y-%m-%d %H:%M:%S")
 
     con = duckdb.connect()
+
+    if span is None:
+        con.execute(f"CREATE VIEW place_csv AS SELECT * FROM read_csv_auto('{csv_file}')")
+    else:
+        # Only parse the indexed span of the csv that covers the window
+        convert_options = pv.ConvertOptions(column_types={"timestamp": pa.string()})
+        con.register("place_csv", pv.read_csv(open_span(csv_file, span), convert_options=convert_options))
     
-    # Query to find the most frequent pixel_color and coord
-    query = f"""
-            WITH
-            pixel_color_frequency AS (
-                SELECT pixel_color, COUNT(*) as frequency
-                FROM read_csv_auto('../../2022_place_canvas_history.csv')
-                WHERE timestamp BETWEEN '{startDate}' AND '{endDate}'
-                GROUP BY pixel_color
-                ORDER BY frequency DESC
-                LIMIT 1
-            ),
-            coord_frequency AS (
-                SELECT coordinate, COUNT(*) as frequency
-                FROM read_csv_auto('../../2022_place_canvas_history.csv')
-                WHERE timestamp BETWEEN '{startDate}' AND '{endDate}'
-                GROUP BY coordinate
-                ORDER BY frequency DESC
-                LIMIT 1
-            )
-            SELECT
-                (SELECT pixel_color FROM pixel_color_frequency),
-                (SELECT coordinate FROM coord_frequency)
-    """
-
-    # Execute the query
-    result = con.execute(query).fetchall()
-    pixel_color = result[0][0]
-    coordinate = result[0][1]
+    # Most frequent pixel_color and coord, both from a single scan of the csv
+    result = run_duckdb(con, "place_csv", f"timestamp BETWEEN '{startDate}' AND '{endDate}'",
+                        ["top_color", "top_coordinate"])
+    pixel_color = result["top_color"]
+    coordinate = result["top_coordinate"]
 
     return pixel_color, coordinate
 
+def duckDB_db(startDate, endDate, db_file=DB_FILE):
+    # Same query against the typed database built by duckDB_ingest.py
+    startDate = datetime.strptime(startDate, "%Y-%m-%d %H").strftime("%Y-%m-%d %H:%M:%S")
+    endDate = datetime.strptime(endDate, "%Y-%m-%d %H").strftime("%Y-%m-%d %H:%M:%S")
+
+    con = duckdb.connect(db_file, read_only=True)
+
+    result = run_duckdb(con, "placements", f"timestamp BETWEEN TIMESTAMP '{startDate}' AND TIMESTAMP '{endDate}'",
+                        ["top_color", "top_coordinate"], columns={"coordinate": COORDINATE_EXPR})
+    con.close()
+
+    return result["top_color"], result["top_coordinate"]
+
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: analyzer.py <start_date> <end_date>")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+
+    if len(args) != 2 or any(flag not in ("--db", "--rebuild", "--rollup", "--no-cache") for flag in flags):
+        print("Usage: analyzer.py <start_date> <end_date> [--db] [--rebuild] [--rollup] [--no-cache]")
         sys.exit(1)
 
     # Extract command-line arguments
-    start_date_str = sys.argv[1]
-    end_date_str = sys.argv[2]
+    start_date_str = args[0]
+    end_date_str = args[1]
+    use_db = "--db" in flags or "--rebuild" in flags
+    use_rollup = "--rollup" in flags
+    cache = ResultCache(enabled="--no-cache" not in flags)
 
     # Validate and start and end date
     startDate, endDate = checkDates(start_date_str, end_date_str)
     
     print(startDate, endDate)
 
+    # (Re)load the database first if the csv changed, so it is not part of the timing
+    if use_db and ingest(rebuild="--rebuild" in flags):
+        print(f"Rebuilt {DB_FILE}")
+
     # Start the timer
     startTime = time.perf_counter_ns()
 
-    color, coord = duckDB(startDate, endDate)
+    if use_rollup:
+        color, coord = query_rollup(startDate, endDate)
+    elif use_db:
+        color, coord = cache.cached("duckdb.top_color_coordinate", [DB_FILE], (startDate, endDate), {},
+                                    lambda: duckDB_db(startDate, endDate))
+    else:
+        color, coord = cache.cached("duckdb.top_color_coordinate", [CSV_FILE], (startDate, endDate), {},
+                                    lambda: duckDB(startDate, endDate))
 
     # End the timer
     endTime = time.perf_counter_ns()
@@ -91,4 +101,5 @@ if __name__ == "__main__":
     print(f"**Execution Time:** {elapsedTime_ms:.6f} ms")
     print(f"**Most Placed Color:** {color} ")
     print(f"**Most Placed Pixel Location:** {coord} ")
+    print(cache.report())
 
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import duckdb
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.hour_index import source_fingerprint
+
+CSV_FILE = '../../2022_place_canvas_history.csv'
+DB_FILE = '../../rPlace.duckdb'
+
+# The coordinate string as it appears in the csv, rebuilt from the typed columns.
+# Moderator rectangle edits keep their second corner in x2/y2.
+COORDINATE_EXPR = """CASE WHEN x2 IS NULL THEN x || ',' || y
+                     ELSE x || ',' || y || ',' || x2 || ',' || y2 END"""
+
+def is_current(db_file, csv_file):
+    if not os.path.exists(db_file):
+        return False
+    # Nothing to compare against, so trust the database we were given
+    if not os.path.exists(csv_file):
+        return True
+
+    con = duckdb.connect(db_file, read_only=True)
+    try:
+        result = con.execute("SELECT size, mtime_ns FROM source_info").fetchall()
+    except duckdb.CatalogException:
+        return False
+    finally:
+        con.close()
+
+    fingerprint = source_fingerprint(csv_file)
+    return result == [(fingerprint["size"], fingerprint["mtime_ns"])]
+
+def ingest(csv_file=CSV_FILE, db_file=DB_FILE, rebuild=False):
+    # Load the csv once into a typed database; skipped when it is already up to date
+    if not rebuild and is_current(db_file, csv_file):
+        return False
+
+    if os.path.exists(db_file):
+        os.remove(db_file)
+
+    con = duckdb.connect(db_file)
+
+    # Raw rows go into a temp table so the csv is only parsed once
+    con.execute(f"""
+                CREATE TEMP TABLE staging AS
+                SELECT * FROM read_csv('{csv_file}', header = true, columns = {{
+                    'timestamp': 'VARCHAR',
+                    'user_id': 'VARCHAR',
+                    'pixel_color': 'VARCHAR',
+                    'coordinate': 'VARCHAR'
+                }})
+                """)
+
+    # Dictionary encode the colors as an enum and the users as integer keys
+    con.execute("CREATE TYPE color_t AS ENUM (SELECT DISTINCT pixel_color FROM staging ORDER BY pixel_color)")
+    con.execute("""
+                CREATE TABLE users AS
+                SELECT CAST(row_number() OVER (ORDER BY user_id) - 1 AS UINTEGER) AS user_key, user_id
+                FROM (SELECT DISTINCT user_id FROM staging)
+                """)
+
+    # Sorted by time so the min/max zonemaps let window filters skip most of the table
+    con.execute("""
+                CREATE TABLE placements AS
+                SELECT
+                    CAST(replace(s.timestamp, ' UTC', '') AS TIMESTAMP) AS timestamp,
+                    u.user_key AS user_id,
+                    CAST(s.pixel_color AS color_t) AS pixel_color,
+                    CAST(split_part(s.coordinate, ',', 1) AS SMALLINT) AS x,
+                    CAST(split_part(s.coordinate, ',', 2) AS SMALLINT) AS y,
+                    CAST(NULLIF(split_part(s.coordinate, ',', 3), '') AS SMALLINT) AS x2,
+                    CAST(NULLIF(split_part(s.coordinate, ',', 4), '') AS SMALLINT) AS y2
+                FROM staging s
+                JOIN users u USING (user_id)
+                ORDER BY timestamp
+                """)
+    con.execute("DROP TABLE staging")
+
+    fingerprint = source_fingerprint(csv_file)
+    con.execute("CREATE TABLE source_info (path VARCHAR, size BIGINT, mtime_ns BIGINT)")
+    con.execute("INSERT INTO source_info VALUES (?, ?, ?)",
+                [os.path.abspath(csv_file), fingerprint["size"], fingerprint["mtime_ns"]])
+    con.close()
+
+    return True
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] != "--rebuild"):
+        print("Usage: duckDB_ingest.py [--rebuild]")
+        sys.exit(1)
+
+    startTime = time.perf_counter_ns()
+
+    built = ingest(rebuild=len(sys.argv) == 2)
+
+    elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+
+    if built:
+        print(f"Loaded {CSV_FILE} into {DB_FILE} in {elapsedTime_ms:.2f} ms")
+    else:
+        print(f"{DB_FILE} is already up to date with {CSV_FILE}")
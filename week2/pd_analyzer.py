@@ -1,49 +1,109 @@
+import os
 import sys
 from datetime import datetime
 import time
 from collections import Counter
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
 
-def checkDates(startDate, endDate):
-    try:
-        datetime.strptime(startDate, "%Y-%m-%d %H")
-    except ValueError:
-        print(f"Error: '{startDate}' is not in the correct format 'YYYY-MM-DD HH'.")
-        sys.exit(1)
-
-    try:
-        datetime.strptime(endDate, "%Y-%m-%d %H")
-    except ValueError:
-        print(f"Error: '{endDate}' is not in the correct format 'YYYY-MM-DD HH'.")
-        sys.exit(1)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.dates import checkDates
+from common.aggregates import required_columns, run_pandas
+from common.hour_index import find_span, open_span
+from common.rollup import query_rollup
 
-    if endDate <= startDate:
-        print("Error: End date must be after the start date.")
-        sys.exit(1) 
-    
-    return startDate, endDate
+CSV_FILE = '../../2022_place_canvas_history.csv'
+MEMORY_BUDGET = 512 * 1024 * 1024  # bytes the chunked mode may use for csv blocks
+# A block of csv takes up roughly this many times its size once it is parsed,
+# filtered and counted, so blocks are sized to budget / BLOCK_EXPANSION
+BLOCK_EXPANSION = 8
 
-def pandas(startDate, endDate):
-    # Read the CSV file
-    df = pd.read_csv('../../2022_place_canvas_history.csv', usecols=['timestamp', 'pixel_color', 'coordinate'])
+def pandas(startDate, endDate, csv_file=CSV_FILE):
+    # Read the CSV file, or just the indexed span that covers the window
+    span = find_span(csv_file, startDate, endDate)
+    source = csv_file if span is None else open_span(csv_file, span)
+    aggregates = ["top_color", "top_coordinate"]
+    df = pd.read_csv(source, usecols=['timestamp'] + required_columns(aggregates))
 
     # Filter rows based on the time range
     filtered_df = df[(df['timestamp'] >= startDate) & (df['timestamp'] <= endDate)]
 
     # Get most placed pixel_color and coordinate
-    pixel_color = filtered_df['pixel_color'].value_counts().idxmax()
-    coordinate = filtered_df['coordinate'].value_counts().idxmax()
+    result = run_pandas(filtered_df, aggregates)
+    pixel_color = result["top_color"]
+    coordinate = result["top_coordinate"]
+
+    return pixel_color, coordinate
+
+def chunk_counts(column):
+    # value_counts of a categorical chunk, in order of first appearance in the chunk
+    codes = column.cat.codes.to_numpy()
+    order = pd.unique(codes)
+    return pd.Series(np.bincount(codes, minlength=len(column.cat.categories))[order],
+                     index=column.cat.categories[order])
+
+def pandas_chunked(startDate, endDate, csv_file=CSV_FILE, memory_budget=MEMORY_BUDGET):
+    # Same answer as pandas() without holding the whole csv in memory. The csv is
+    # streamed in blocks by arrow's csv reader (the pandas pyarrow engine does not
+    # support chunksize), with color and coordinate dictionary encoded so they come
+    # out as pandas categoricals. Each block is filtered to the window and its
+    # value_counts merged into the running totals, keeping first appearance order
+    # so ties break the same way as in the eager path.
+    span = find_span(csv_file, startDate, endDate)
+    source = csv_file if span is None else open_span(csv_file, span)
+    aggregates = ["top_color", "top_coordinate"]
+    columns = required_columns(aggregates)
+    category = pa.dictionary(pa.int32(), pa.string())
+
+    reader = pv.open_csv(
+        source,
+        read_options=pv.ReadOptions(block_size=max(memory_budget // BLOCK_EXPANSION, 1024 * 1024)),
+        convert_options=pv.ConvertOptions(
+            include_columns=['timestamp'] + columns,
+            column_types={"timestamp": pa.string(), **{column: category for column in columns}},
+        ),
+    )
+
+    counts = {column: None for column in columns}
+    for batch in reader:
+        # Filter rows based on the time range
+        inWindow = pc.and_(pc.greater_equal(batch.column('timestamp'), startDate),
+                           pc.less_equal(batch.column('timestamp'), endDate))
+        chunk = batch.filter(inWindow).select(columns).to_pandas()
+        if len(chunk) == 0:
+            continue
+
+        for column in columns:
+            partial = chunk_counts(chunk[column])
+            if counts[column] is None:
+                counts[column] = partial
+            else:
+                counts[column] = pd.concat([counts[column], partial]).groupby(level=0, sort=False).sum()
+
+    pixel_color, coordinate = (None if counts[column] is None else counts[column].idxmax()
+                               for column in columns)
 
     return pixel_color, coordinate
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: analyzer.py <start_date> <end_date>")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+
+    if len(args) != 2 or any(flag not in ("--rollup", "--chunked") and not flag.startswith("--budget=")
+                             for flag in flags):
+        print("Usage: analyzer.py <start_date> <end_date> [--rollup] [--chunked] [--budget=<MB>]")
         sys.exit(1)
 
     # Extract command-line arguments
-    start_date_str = sys.argv[1]
-    end_date_str = sys.argv[2]
+    start_date_str = args[0]
+    end_date_str = args[1]
+    use_rollup = "--rollup" in flags
+    budgets = [flag for flag in flags if flag.startswith("--budget=")]
+    use_chunked = "--chunked" in flags or bool(budgets)
+    memory_budget = int(budgets[-1].split("=", 1)[1]) * 1024 * 1024 if budgets else MEMORY_BUDGET
 
     # Validate and start and end date
     startDate, endDate = checkDates(start_date_str, end_date_str)
@@ -51,7 +111,12 @@ if __name__ == "__main__":
     # Start the timer
     startTime = time.perf_counter_ns()
 
-    color, coord = pandas(startDate, endDate)
+    if use_rollup:
+        color, coord = query_rollup(startDate, endDate)
+    elif use_chunked:
+        color, coord = pandas_chunked(startDate, endDate, memory_budget=memory_budget)
+    else:
+        color, coord = pandas(startDate, endDate)
 
     # End the timer
     endTime = time.perf_counter_ns()
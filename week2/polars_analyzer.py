@@ -1,69 +1,100 @@
+import os
 import sys
 from datetime import datetime
 import time
 from collections import Counter
+
+# polars sizes its thread pool when it is first imported, so --threads has to be
+# applied before the import below
+if __name__ == "__main__":
+    for arg in sys.argv[1:]:
+        if arg.startswith("--threads="):
+            os.environ["POLARS_MAX_THREADS"] = arg.split("=", 1)[1]
+
 import polars as pl
 
-def checkDates(startDate, endDate):
-    try:
-        datetime.strptime(startDate, "%Y-%m-%d %H")
-    except ValueError:
-        print(f"Error: '{startDate}' is not in the correct format 'YYYY-MM-DD HH'.")
-        sys.exit(1)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.aggregates import run_polars
+from common.dates import checkDates, to_epoch_ms
+from common.hour_index import find_span, open_span
+from common.rollup import query_rollup
 
-    try:
-        datetime.strptime(endDate, "%Y-%m-%d %H")
-    except ValueError:
-        print(f"Error: '{endDate}' is not in the correct format 'YYYY-MM-DD HH'.")
-        sys.exit(1)
+CSV_FILE = '../../2022_place_canvas_history.csv'
+PARQUET_FILE = '../week3/rPlace.parquet'  # written by week3/preprocess.py
 
-    if endDate <= startDate:
-        print("Error: End date must be after the start date.")
-        sys.exit(1) 
-    
-    return startDate, endDate
+def scan_parquet(parquet_file):
+    # The preprocessed files in the csv's shape: placements and moderator rectangles
+    # with pixel_color looked up from the palette and coordinate rebuilt from x/y
+    data_dir = os.path.dirname(parquet_file)
+    palette = pl.scan_parquet(os.path.join(data_dir, 'palette.parquet'))
+    xy = [pl.col("x").cast(pl.String), pl.col("y").cast(pl.String)]
 
-def polars(startDate, endDate):
-    startDate = datetime.strptime(startDate, "%Y-%m-%d %H").strftime("%Y-%m-%d %H:%M:%S")
-    endDate = datetime.strptime(endDate, "%Y-%m-%d %H").strftime("%Y-%m-%d %H:%M:%S")
+    frames = [pl.scan_parquet(parquet_file)
+              .select("timestamp", "color_index", pl.concat_str(xy, separator=",").alias("coordinate"))]
+    rectangle_file = os.path.join(data_dir, 'rPlace_rectangles.parquet')
+    if os.path.exists(rectangle_file):
+        corners = [pl.col(name).cast(pl.String) for name in ("x1", "y1", "x2", "y2")]
+        frames.append(pl.scan_parquet(rectangle_file)
+                      .select("timestamp", "color_index", pl.concat_str(corners, separator=",").alias("coordinate")))
 
-    lazy_df = pl.scan_csv("../../2022_place_canvas_history.csv")
+    return pl.concat(frames).join(palette, on="color_index")
 
-    filtered = (
-        lazy_df
-        .filter((pl.col("timestamp") >= pl.lit(startDate)) & (pl.col("timestamp") <= pl.lit(endDate)))
-        .collect()  # Execute and load into memory after filtering
-    )
+def polars(startDate, endDate, csv_file=CSV_FILE, parquet_file=None, streaming=True, chunk_size=None):
+    # Everything stays lazy until run_polars collects both aggregates together, so
+    # they share one scan; on the streaming engine that scan runs in batches over
+    # all cores instead of materializing the window
+    if parquet_file is not None:
+        filtered = (
+            scan_parquet(parquet_file)
+            .filter(pl.col("timestamp").is_between(to_epoch_ms(startDate), to_epoch_ms(endDate)))
+        )
+    else:
+        span = find_span(csv_file, startDate, endDate)
+
+        startDate = datetime.strptime(startDate, "%Y-%m-%d %H").strftime("%Y-%m-%d %H:%M:%S")
+        endDate = datetime.strptime(endDate, "%Y-%m-%d %H").strftime("%Y-%m-%d %H:%M:%S")
+
+        if span is None:
+            lazy_df = pl.scan_csv(csv_file)
+        else:
+            # The hour index narrowed the window down to a small span, read only that
+            lazy_df = pl.read_csv(open_span(csv_file, span)).lazy()
+
+        filtered = (
+            lazy_df
+            .filter((pl.col("timestamp") >= pl.lit(startDate)) & (pl.col("timestamp") <= pl.lit(endDate)))
+        )
 
     # same query as duckDB in polars form
-    pixel_color = (
-        filtered
-        .group_by("pixel_color")  
-        .len()  
-        .sort("len", descending=True)  
-        .select("pixel_color")
-        .head(1)  
-    )[0, "pixel_color"]
-
-    coordinate = (
-        filtered
-        .group_by("coordinate") 
-        .len()  
-        .sort("len", descending=True)  
-        .select("coordinate")
-        .head(1)  
-    )[0, "coordinate"]
+    options = {} if chunk_size is None else {"streaming_chunk_size": chunk_size}
+    with pl.Config(**options):
+        result = run_polars(filtered, ["top_color", "top_coordinate"],
+                            engine="streaming" if streaming else "in-memory")
+    pixel_color = result["top_color"]
+    coordinate = result["top_coordinate"]
     
     return pixel_color, coordinate
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: analyzer.py <start_date> <end_date>")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+
+    options = dict(flag[2:].split("=", 1) for flag in flags if "=" in flag)
+    switches = [flag for flag in flags if "=" not in flag]
+
+    if (len(args) != 2 or any(flag not in ("--rollup", "--parquet", "--in-memory") for flag in switches)
+            or any(name not in ("threads", "chunk-size") for name in options)):
+        print("Usage: analyzer.py <start_date> <end_date> [--rollup] [--parquet] [--in-memory] "
+              "[--threads=<n>] [--chunk-size=<rows>]")
         sys.exit(1)
 
     # Extract command-line arguments
-    start_date_str = sys.argv[1]
-    end_date_str = sys.argv[2]
+    start_date_str = args[0]
+    end_date_str = args[1]
+    use_rollup = "--rollup" in switches
+    parquet_file = PARQUET_FILE if "--parquet" in switches else None
+    streaming = "--in-memory" not in switches
+    chunk_size = int(options["chunk-size"]) if "chunk-size" in options else None
 
     # Validate and start and end date
     startDate, endDate = checkDates(start_date_str, end_date_str)
@@ -71,7 +102,11 @@ if __name__ == "__main__":
     # Start the timer
     startTime = time.perf_counter_ns()
 
-    color, coord = polars(startDate, endDate)
+    if use_rollup:
+        color, coord = query_rollup(startDate, endDate)
+    else:
+        color, coord = polars(startDate, endDate, parquet_file=parquet_file, streaming=streaming,
+                              chunk_size=chunk_size)
 
     # End the timer
     endTime = time.perf_counter_ns()
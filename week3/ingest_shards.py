@@ -0,0 +1,292 @@
+import argparse
+import glob
+import json
+import os
+import struct
+import sys
+import time
+from collections import Counter
+from multiprocessing import Pool
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.csv as pv
+
+from preprocess import (DATASET_DIR, PALETTE_FILE, ROW_GROUP_SIZE, USER_ID_FILE, convert_batch,
+                        empty_user_id_mapping, extend_mapping, file_sha256, load_manifest, seed_palette,
+                        write_atomic, write_part)
+
+# Parallel ingestion of the gzipped csv shards into the append dataset of
+# preprocess.py (same parts, manifest and dictionaries as --append).
+#
+#   1. hash      every shard, in parallel, to skip the ones already ingested
+#   2. convert   every shard in a worker process: decompress, parse and transform
+#                it with its own shard local user ids / palette, staged to parquet
+#   3. merge     the local dictionaries into the global ones in shard order, in
+#                the main process. Users get ids in order of first appearance in
+#                the shards taken in order, whatever order the workers finished
+#                in, which is exactly the ids a sequential --append would assign.
+#   4. finalize  every shard in a worker: swap local for global ids and write the
+#                timestamp sorted part
+#
+# Workers are limited so that their estimated peak memory stays within the budget.
+#
+# Like --append, the new parts reach the analyses once preprocess.py --merge folds
+# them into rPlace.parquet.
+
+MEMORY_BUDGET = 8 * 1024 * 1024 * 1024
+BLOCK_SIZE = 64 * 1024 * 1024  # bytes of decompressed csv parsed at a time
+# A parsed and transformed csv block takes up to this many times its size
+BLOCK_EXPANSION = 8
+# Converted rows (compact schema, plus local dictionaries) relative to the csv size
+COMPACT_RATIO = 0.25
+
+class TimedStream:
+    # File-like wrapper that counts the bytes and time spent decompressing
+    def __init__(self, stream):
+        self.stream = stream
+        self.seconds = 0.0
+        self.bytes = 0
+
+    @property
+    def closed(self):
+        return self.stream.closed
+
+    def read(self, nbytes=-1):
+        startTime = time.perf_counter()
+        data = self.stream.read(nbytes)
+        self.seconds += time.perf_counter() - startTime
+        self.bytes += len(data)
+        return data
+
+    def close(self):
+        self.stream.close()
+
+def uncompressed_size(shard):
+    # gzip keeps the uncompressed size (mod 2**32) in its last four bytes
+    if not shard.endswith('.gz'):
+        return os.path.getsize(shard)
+    with open(shard, 'rb') as file:
+        file.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', file.read(4))[0]
+
+def plan_workers(shards, workers, memory_budget, block_size=BLOCK_SIZE):
+    per_worker = block_size * BLOCK_EXPANSION + max(map(uncompressed_size, shards)) * COMPACT_RATIO
+    return max(1, min(workers, len(shards), int(memory_budget // per_worker))), per_worker
+
+def staged(staging_dir, i, kind):
+    return os.path.join(staging_dir, f"{i:05d}.{kind}.parquet")
+
+def convert_shard(task):
+    i, shard, staging_dir, block_size = task
+    stats = Counter()
+
+    startTime = time.perf_counter()
+    stream = TimedStream(pa.input_stream(shard, compression='detect'))
+    # One thread per worker, the pool provides the parallelism
+    reader = pv.open_csv(stream, read_options=pv.ReadOptions(block_size=block_size, use_threads=False))
+    stats["read_seconds"] += time.perf_counter() - startTime
+
+    user_id_mapping = empty_user_id_mapping()
+    palette = seed_palette()
+    placements = []
+    rectangles = []
+    while True:
+        startTime = time.perf_counter()
+        try:
+            record_batch = reader.read_next_batch()
+        except StopIteration:
+            break
+        stats["read_seconds"] += time.perf_counter() - startTime
+        stats["rows"] += record_batch.num_rows
+
+        startTime = time.perf_counter()
+        df, batch_rectangles, user_id_mapping, palette = convert_batch(record_batch, user_id_mapping, palette)
+        placements.append(df)
+        rectangles.append(batch_rectangles)
+        stats["transform_seconds"] += time.perf_counter() - startTime
+
+    stats["compressed_bytes"] = os.path.getsize(shard)
+    stats["csv_bytes"] = stream.bytes
+    stats["decompress_seconds"] = stream.seconds
+    stats["parse_seconds"] = stats.pop("read_seconds") - stream.seconds
+    stream.close()
+
+    startTime = time.perf_counter()
+    pl.concat(placements).write_parquet(staged(staging_dir, i, 'placements'))
+    pl.concat(rectangles).write_parquet(staged(staging_dir, i, 'rectangles'))
+    user_id_mapping.write_parquet(staged(staging_dir, i, 'users'))
+    palette.write_parquet(staged(staging_dir, i, 'palette'))
+    stats["stage_seconds"] = time.perf_counter() - startTime
+
+    return i, stats
+
+def finalize_shard(task):
+    i, dataset_dir, staging_dir, name, user_remap, color_remap, row_group_size = task
+    stats = Counter()
+    startTime = time.perf_counter()
+
+    for kind in ('placements', 'rectangles'):
+        df = pl.read_parquet(staged(staging_dir, i, kind))
+        df = df.with_columns(
+            pl.Series("user_id_numerical", user_remap[df["user_id_numerical"].to_numpy()]),
+            pl.Series("color_index", color_remap[df["color_index"].to_numpy()]),
+        )
+        write_part(df, os.path.join(dataset_dir, kind, name), row_group_size)
+        if kind == 'placements':
+            stats["rows"] = df.height
+            stats["min_timestamp"] = df["timestamp"].min()
+            stats["max_timestamp"] = df["timestamp"].max()
+        stats["part_bytes"] += os.path.getsize(os.path.join(dataset_dir, kind, name))
+
+    for kind in ('placements', 'rectangles', 'users', 'palette'):
+        os.remove(staged(staging_dir, i, kind))
+
+    stats["finalize_seconds"] = time.perf_counter() - startTime
+    return i, stats
+
+def remap(local, mapping, key, id_column):
+    # Global id of every local id (local ids are 0..n-1 in order)
+    joined = local.join(mapping, on=key, how="left", maintain_order="left", suffix="_global")
+    return joined[id_column + "_global"].to_numpy()
+
+def throughput(megabytes, seconds):
+    return f"{megabytes / seconds:.1f} MB/s" if seconds else "n/a"
+
+def print_report(stats, phase_seconds, workers):
+    mb = 1024 * 1024
+    rows = stats["rows"]
+    print("\n**Stage Throughput** (seconds summed over workers, rates per worker)")
+    print(f"- hash: {phase_seconds['hash']:.2f} s wall, "
+          f"{throughput(stats['hashed_bytes'] / mb, phase_seconds['hash'] * workers)}")
+    print(f"- decompress: {stats['decompress_seconds']:.2f} s, "
+          f"{throughput(stats['csv_bytes'] / mb, stats['decompress_seconds'])} of csv")
+    print(f"- parse: {stats['parse_seconds']:.2f} s, {throughput(stats['csv_bytes'] / mb, stats['parse_seconds'])}")
+    print(f"- transform: {stats['transform_seconds']:.2f} s, "
+          f"{rows / stats['transform_seconds'] if stats['transform_seconds'] else 0:,.0f} rows/s")
+    print(f"- stage: {stats['stage_seconds']:.2f} s")
+    print(f"- merge dictionaries: {phase_seconds['merge']:.2f} s (main process)")
+    print(f"- finalize: {stats['finalize_seconds']:.2f} s, "
+          f"{throughput(stats['part_bytes'] / mb, stats['finalize_seconds'])} of parquet written")
+    total = sum(phase_seconds.values())
+    print(f"**Total:** {rows:,} rows from {stats['compressed_bytes'] / mb:.1f} MB of shards in {total:.2f} s "
+          f"({rows / total if total else 0:,.0f} rows/s, {workers} workers)")
+
+def ingest_shards(shards, dataset_dir=DATASET_DIR, user_id_file=USER_ID_FILE, palette_file=PALETTE_FILE,
+                  workers=None, memory_budget=MEMORY_BUDGET, row_group_size=ROW_GROUP_SIZE, block_size=BLOCK_SIZE):
+    phase_seconds = {}
+    manifest = load_manifest(dataset_dir)
+    ingested = {part["sha256"] for part in manifest["parts"]}
+    workers, per_worker = plan_workers(shards, workers or os.cpu_count(), memory_budget, block_size)
+    print(f"Using {workers} workers (~{per_worker / 1024 / 1024:.0f} MB each, "
+          f"budget {memory_budget / 1024 / 1024:.0f} MB)")
+
+    with Pool(workers) as pool:
+        startTime = time.perf_counter()
+        hashes = pool.map(file_sha256, shards)
+        phase_seconds["hash"] = time.perf_counter() - startTime
+
+        new = []
+        for shard, sha256 in zip(shards, hashes):
+            if sha256 in ingested:
+                print(f"Skipping {shard}, already ingested")
+            elif sha256 not in (new_sha for _, new_sha in new):
+                new.append((shard, sha256))
+        if not new:
+            print(f"Nothing new to ingest into {dataset_dir}")
+            return 0
+
+        staging_dir = os.path.join(dataset_dir, 'staging')
+        for directory in ('placements', 'rectangles', 'staging'):
+            os.makedirs(os.path.join(dataset_dir, directory), exist_ok=True)
+
+        startTime = time.perf_counter()
+        stats = Counter(hashed_bytes=sum(map(os.path.getsize, shards)))
+        tasks = [(i, shard, staging_dir, block_size) for i, (shard, _) in enumerate(new)]
+        for i, shard_stats in pool.imap_unordered(convert_shard, tasks):
+            print(f"Converted {new[i][0]} ({shard_stats['rows']} rows)")
+            stats.update(shard_stats)
+        phase_seconds["convert"] = time.perf_counter() - startTime
+
+        # Global ids, assigned in shard order
+        startTime = time.perf_counter()
+        if os.path.exists(user_id_file):
+            user_id_mapping = pl.read_parquet(user_id_file).select("user_id", "user_id_numerical")
+        else:
+            user_id_mapping = empty_user_id_mapping()
+        if os.path.exists(palette_file):
+            palette = pl.read_parquet(palette_file).select("pixel_color", "color_index")
+        else:
+            palette = seed_palette()
+
+        remaps = []
+        for i in range(len(new)):
+            local_users = pl.read_parquet(staged(staging_dir, i, 'users'))
+            local_palette = pl.read_parquet(staged(staging_dir, i, 'palette'))
+            user_id_mapping = extend_mapping(user_id_mapping, local_users, "user_id", "user_id_numerical")
+            palette = extend_mapping(palette, local_palette, "pixel_color", "color_index")
+            if palette.height > 256:
+                raise ValueError(f"{palette.height} distinct colors do not fit in a uint8 color index")
+            remaps.append((remap(local_users, user_id_mapping, "user_id", "user_id_numerical"),
+                           remap(local_palette, palette, "pixel_color", "color_index").astype(np.uint8)))
+        phase_seconds["merge"] = time.perf_counter() - startTime
+
+        startTime = time.perf_counter()
+        first_part = len(manifest["parts"])
+        names = [f"part-{first_part + i:05d}.parquet" for i in range(len(new))]
+        tasks = [(i, dataset_dir, staging_dir, names[i], *remaps[i], row_group_size) for i in range(len(new))]
+        finalized = {}
+        for i, shard_stats in pool.imap_unordered(finalize_shard, tasks):
+            finalized[i] = shard_stats
+            stats["finalize_seconds"] += shard_stats["finalize_seconds"]
+            stats["part_bytes"] += shard_stats["part_bytes"]
+        phase_seconds["finalize"] = time.perf_counter() - startTime
+
+    os.rmdir(staging_dir)
+
+    # Dictionaries first: parts are only listed once the ids they use are saved
+    write_atomic(user_id_file, lambda tmp_file: user_id_mapping.write_parquet(tmp_file, compression="zstd"))
+    write_atomic(palette_file, lambda tmp_file: palette.select("color_index", "pixel_color").write_parquet(tmp_file))
+
+    for i, (shard, sha256) in enumerate(new):
+        manifest["parts"].append({
+            "source": os.path.basename(shard),
+            "sha256": sha256,
+            "part": names[i],
+            "rows": finalized[i]["rows"],
+            "min_timestamp": finalized[i]["min_timestamp"],
+            "max_timestamp": finalized[i]["max_timestamp"],
+        })
+    manifest["users"] = user_id_mapping.height
+    manifest["colors"] = palette.height
+
+    def write_manifest(tmp_file):
+        with open(tmp_file, 'w') as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+    write_atomic(os.path.join(dataset_dir, 'manifest.json'), write_manifest)
+
+    print(f"Ingested {len(new)} new shard(s) into {dataset_dir}, {len(manifest['parts'])} part(s) in total")
+    print_report(stats, phase_seconds, workers)
+    return len(new)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest gzipped csv shards into the parquet dataset in parallel")
+    parser.add_argument("shards", nargs="+", help="shard files, or directories of *.csv.gz shards")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--memory-budget", type=int, default=MEMORY_BUDGET // (1024 * 1024),
+                        help="memory the workers may use together, in MB (default: %(default)s)")
+    parser.add_argument("--dataset-dir", default=DATASET_DIR, help="dataset directory (default: %(default)s)")
+    parser.add_argument("--row-group-size", type=int, default=ROW_GROUP_SIZE,
+                        help="rows per parquet row group (default: %(default)s)")
+    args = parser.parse_args()
+
+    # Shards are ingested (and ids assigned) in the order given, directories in file name order
+    shards = []
+    for path in args.shards:
+        shards += sorted(glob.glob(os.path.join(path, '*.csv.gz'))) if os.path.isdir(path) else [path]
+    if not shards:
+        print("Error: no shards found.")
+        sys.exit(1)
+
+    ingest_shards(shards, args.dataset_dir, workers=args.workers, memory_budget=args.memory_budget * 1024 * 1024,
+                  row_group_size=args.row_group_size)
@@ -1,182 +1,112 @@
+import os
 import sys
-from datetime import datetime
 import time
 from collections import Counter
 import duckdb
-import webcolors
 import pandas as pd
 
-def checkDates(startDate, endDate):
-    try:
-        datetime.strptime(startDate, "%Y-%m-%d %H")
-    except ValueError:
-        print(f"Error: '{startDate}' is not in the correct format 'YYYY-MM-DD HH'.")
-        sys.exit(1)
+from percentiles import window_percentiles
+from sessionizer import session_stats
 
-    try:
-        datetime.strptime(endDate, "%Y-%m-%d %H")
-    except ValueError:
-        print(f"Error: '{endDate}' is not in the correct format 'YYYY-MM-DD HH'.")
-        sys.exit(1)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.dates import checkDates, to_epoch_ms
+from common.distinct import DistinctCounter
+from common.palette import names_for
+from common.result_cache import ResultCache
 
-    if endDate <= startDate:
-        print("Error: End date must be after the start date.")
-        sys.exit(1) 
-    
-    return startDate, endDate
-
-def hex_to_name(hex):
-    try:
-        return webcolors.hex_to_name(hex)
-    except ValueError:
-        return hex_to_closest_name(hex)
-
-def hex_to_closest_name(hex):
-    css3_colors = {name: webcolors.name_to_rgb(name) for name in webcolors.names("css3")}
-    target = webcolors.hex_to_rgb(hex)
-    # Find the closest color by calculating the Euclidean distance
-    closest_color = min(
-        css3_colors,
-        key=lambda name: sum((css3_colors[name][i] - target[i]) ** 2 for i in range(3))
-    )
-    return closest_color
-
-def parquet_analyzer(startDate, endDate):
+BATCH_ROWS = 1_000_000
+
+def distinct_users_by_color(con, parquet_file, startDate, endDate, mode="exact"):
+    # Stream (color, user) pairs of the window into per color bitmaps or sketches
+    counter = DistinctCounter(mode)
+    reader = con.execute(f"""
+                        SELECT color_index, user_id_numerical
+                        FROM parquet_scan('{parquet_file}')
+                        WHERE timestamp BETWEEN {startDate} AND {endDate}
+                        """).fetch_record_batch(BATCH_ROWS)
+
+    for batch in reader:
+        counter.add(batch.column(0).to_numpy(), batch.column(1).to_numpy())
+
+    return counter
+
+def parquet_analyzer(startDate, endDate, distinct_mode="exact", cache=None):
     # Format start and end date to wort with query
-    startDate = datetime.strptime(startDate, "%Y-%m-%d %H").strftime("%Y-%m-%d %H:%M:%S")
-    endDate = datetime.strptime(endDate, "%Y-%m-%d %H").strftime("%Y-%m-%d %H:%M:%S")
+    startDate = to_epoch_ms(startDate)
+    endDate = to_epoch_ms(endDate)
     parquet_file = './rPlace.parquet'
+    palette_file = './palette.parquet'
+    first_seen_file = './user_first_seen.parquet'
 
     con = duckdb.connect()
-    
+    cache = cache or ResultCache(enabled=False)
+    window = (startDate, endDate)
+
     # Ranking of Colors by Distinct Users
-    result = con.execute(f"""
-                            SELECT 
-                                pixel_color, 
-                                COUNT(DISTINCT user_id_numerical) AS distinct_user_count
-                            FROM 
-                                parquet_scan('{parquet_file}')
-                            WHERE 
-                                timestamp BETWEEN '{startDate}' AND '{endDate}'
-                            GROUP BY 
-                                pixel_color
-                            ORDER BY 
-                                distinct_user_count DESC
-                            """).fetchall()
-    print("**Top Ranking of Colors by Distinct Users**")
+    def color_ranking():
+        counter = distinct_users_by_color(con, parquet_file, startDate, endDate, distinct_mode)
+        palette = dict(con.execute(f"SELECT color_index, pixel_color FROM parquet_scan('{palette_file}')").fetchall())
+        result = sorted(((palette[color], count) for color, count in counter.counts().items()),
+                        key=lambda res: res[1], reverse=True)
+        return result, counter.error_bound
+
+    result, error_bound = cache.cached("parquet.color_ranking", [parquet_file, palette_file], window,
+                                       {"distinct_mode": distinct_mode}, color_ranking)
+
+    if distinct_mode == "approx":
+        print(f"**Top Ranking of Colors by Distinct Users** (approximate, ±{error_bound:.2%})")
+    else:
+        print("**Top Ranking of Colors by Distinct Users**")
+    color_names = names_for([res[0] for res in result])
     for i, res in enumerate(result):
-        print(f"{i + 1}. {hex_to_name(res[0])}: {res[1]} users")
-
-     # Average Session Length
-    result = con.execute(f"""WITH session_starts AS (
-                                SELECT
-                                    user_id_numerical,
-                                    timestamp,
-                                    CASE
-                                        WHEN EXTRACT(EPOCH FROM timestamp) - EXTRACT(EPOCH FROM LAG(timestamp) OVER (
-                                            PARTITION BY user_id_numerical
-                                            ORDER BY timestamp
-                                        )) > 900 OR LAG(timestamp) OVER (
-                                            PARTITION BY user_id_numerical
-                                            ORDER BY timestamp
-                                        ) IS NULL THEN 1
-                                        ELSE 0
-                                    END AS new_session_flag
-                                FROM
-                                    parquet_scan('{parquet_file}')
-                                WHERE
-                                    timestamp BETWEEN '{startDate}' AND '{endDate}'
-                            ),
-                            -- Group sessions by user and assign unique session IDs
-                            grouped_sessions AS (
-                                SELECT
-                                    user_id_numerical,
-                                    timestamp,
-                                    SUM(new_session_flag) OVER (
-                                        PARTITION BY user_id_numerical
-                                        ORDER BY timestamp
-                                    ) AS session_id
-                                FROM
-                                    session_starts
-                            ),
-                            -- Calculate sessions with start, end, and event count
-                            sessions AS (
-                                SELECT
-                                    MIN(timestamp) AS session_start,
-                                    MAX(timestamp) AS session_end,
-                                FROM
-                                    grouped_sessions
-                                GROUP BY
-                                    user_id_numerical, session_id
-                                HAVING
-                                    COUNT(*) > 1 -- Exclude sessions with only 1 event
-                            )
-                            SELECT
-                                AVG(EXTRACT(EPOCH FROM session_end) - EXTRACT(EPOCH FROM session_start)) AS average_session_length
-                            FROM
-                                sessions;
-                            """).fetchall()
+        print(f"{i + 1}. {color_names[i]}: {res[1]} users")
+
+     # Average Session Length, from the streaming sessionizer
+    session_length = cache.cached("parquet.average_session_length", [parquet_file], window, {},
+                                  lambda: session_stats(con, parquet_file, startDate, endDate)["average_session_length"])
 
     print("\n**Average Session Length**")
-    print(f"Output: {result[0][0]:.2f} seconds\n")
-
-
-     # Pixel Counts
-    result = con.execute(f"""
-                           WITH pixel_counts AS (
-                                SELECT
-                                    COUNT(*) AS pixels_placed
-                                FROM
-                                    parquet_scan('{parquet_file}')
-                                WHERE
-                                    timestamp BETWEEN '{startDate}' AND '{endDate}'
-                                GROUP BY
-                                    user_id_numerical
-                            )
-                            SELECT
-                                PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY pixels_placed) AS percentile_50,
-                                PERCENTILE_CONT(0.75) WITHIN GROUP (ORDER BY pixels_placed) AS percentile_75,
-                                PERCENTILE_CONT(0.9) WITHIN GROUP (ORDER BY pixels_placed) AS percentile_90,
-                                PERCENTILE_CONT(0.99) WITHIN GROUP (ORDER BY pixels_placed) AS percentile_99
-                            FROM
-                                pixel_counts;
-                        """).fetchall()
+    # None when no user placed more than one pixel in the window
+    print(f"Output: {session_length:.2f} seconds\n" if session_length is not None else "Output: no sessions\n")
+
+
+     # Pixel Counts, percentiles read off the cached per window histogram of counts
+    percentiles = [0.5, 0.75, 0.9, 0.99]
+    values = cache.cached("parquet.percentiles", [parquet_file], window, {"percentiles": percentiles},
+                          lambda: window_percentiles(con, parquet_file, startDate, endDate, percentiles))
 
     print("**Percentiles of Pixels Placed**")
-    print(f'50th Percentile: {result[0][0]} pixels')
-    print(f'75th Percentile: {result[0][1]} pixels')
-    print(f'90th Percentile: {result[0][2]} pixels')
-    print(f'99th Percentile: {result[0][3]} pixels\n')
+    for q, value in zip(percentiles, values):
+        print(f'{q * 100:g}th Percentile: {value} pixels')
+    print()
 
 
-    # Count of First-Time Users
-    result = con.execute(f"""
+    # Count of First-Time Users, users whose first placement ever falls in the window
+    result = cache.cached("parquet.first_time_users", [first_seen_file], window, {}, lambda: con.execute(f"""
                            SELECT
-                                COUNT(DISTINCT user_id_numerical) AS first_time_users
+                                COUNT(*) AS first_time_users
                             FROM
-                                parquet_scan('{parquet_file}')
+                                parquet_scan('{first_seen_file}')
                             WHERE
-                                timestamp BETWEEN '{startDate}' AND '{endDate}'AND user_id_numerical NOT IN (
-                                    SELECT
-                                        DISTINCT user_id_numerical
-                                    FROM
-                                        parquet_scan('{parquet_file}')
-                                    WHERE
-                                        timestamp < '{startDate}'
-                                );
-                            """).fetchall()
+                                first_ts BETWEEN {startDate} AND {endDate};
+                            """).fetchall())
 
     print("**Count of First-Time Users**")
     print(f"Output: {result[0][0]} users\n")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: analyzer.py <start_date> <end_date>")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+
+    if len(args) != 2 or any(flag not in ("--approx", "--no-cache") for flag in flags):
+        print("Usage: analyzer.py <start_date> <end_date> [--approx] [--no-cache]")
         sys.exit(1)
 
     # Extract command-line arguments
-    start_date_str = sys.argv[1]
-    end_date_str = sys.argv[2]
+    start_date_str = args[0]
+    end_date_str = args[1]
+    distinct_mode = "approx" if "--approx" in flags else "exact"
+    cache = ResultCache(enabled="--no-cache" not in flags)
 
     # Validate and start and end date
     startDate, endDate = checkDates(start_date_str, end_date_str)
@@ -186,7 +116,7 @@ if __name__ == "__main__":
     # Start the timer
     startTime = time.perf_counter_ns()
 
-    parquet_analyzer(startDate, endDate)
+    parquet_analyzer(startDate, endDate, distinct_mode, cache)
 
     # End the timer
     endTime = time.perf_counter_ns()
@@ -197,4 +127,5 @@ if __name__ == "__main__":
     
     print(f"**Timeframe:** {start_date_str} to {end_date_str}")
     print(f"**Execution Time:** {elapsedTime_ms:.4f} ms")
+    print(cache.report())
 
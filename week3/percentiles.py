@@ -0,0 +1,147 @@
+import os
+import hashlib
+import os
+import sys
+import threading
+import time
+import zipfile
+import duckdb
+import numpy as np
+
+# Percentiles of pixels placed per user. One streaming pass over the window builds
+# a dense count array indexed by user_id_numerical, which is folded into a histogram
+# of counts (how many users placed exactly k pixels). Most users place only a few
+# pixels so the histogram is tiny, and any percentile can be read off it exactly with
+# the same linear interpolation as PERCENTILE_CONT. Histograms are cached per window
+# so asking for different percentiles does not rescan. The cache lives next to the
+# parquet file and is safe to share between threads (server.py).
+
+PERCENTILES = [0.5, 0.75, 0.9, 0.99]
+CACHE_DIR = 'percentile_cache'  # relative to the directory of the parquet file
+BATCH_ROWS = 1_000_000
+
+memory_cache = {}
+cache_lock = threading.Lock()
+
+def source_fingerprint(parquet_file):
+    stat = os.stat(parquet_file)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def user_counts(con, parquet_file, startDate, endDate, batch_rows=BATCH_ROWS):
+    # Pixels placed per user in the window, indexed by user_id_numerical
+    counts = np.zeros(0, dtype=np.int64)
+    reader = con.execute(f"""
+                        SELECT user_id_numerical
+                        FROM parquet_scan('{parquet_file}')
+                        WHERE timestamp BETWEEN {startDate} AND {endDate}
+                        """).fetch_record_batch(batch_rows)
+
+    for batch in reader:
+        partial = np.bincount(batch.column(0).to_numpy())
+        if len(partial) > len(counts):
+            counts = np.pad(counts, (0, len(partial) - len(counts)))
+        counts[:len(partial)] += partial
+
+    return counts
+
+def cache_name(parquet_file, fingerprint, startDate, endDate):
+    # Files of different parquet files, or versions of one, never share a name
+    source = hashlib.sha256(f"{os.path.abspath(parquet_file)}:{fingerprint[0]}:{fingerprint[1]}".encode())
+    return f"{source.hexdigest()[:16]}_{startDate}_{endDate}.npz"
+
+def load_cached(cache_file, fingerprint):
+    try:
+        with np.load(cache_file) as data:
+            if np.array_equal(data["fingerprint"], fingerprint):
+                return data["hist"]
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        pass
+    return None
+
+def count_histogram(con, parquet_file, startDate, endDate, cache_dir=None):
+    # hist[k] = number of users who placed exactly k pixels (k >= 1)
+    key = (os.path.abspath(parquet_file), startDate, endDate)
+    fingerprint = source_fingerprint(parquet_file)
+
+    with cache_lock:
+        cached = memory_cache.get(key)
+    if cached is not None and np.array_equal(cached[0], fingerprint):
+        return cached[1]
+
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(parquet_file)), CACHE_DIR)
+    cache_file = os.path.join(cache_dir, cache_name(parquet_file, fingerprint, startDate, endDate))
+    hist = load_cached(cache_file, fingerprint)
+
+    if hist is None:
+        counts = user_counts(con, parquet_file, startDate, endDate)
+        hist = np.bincount(counts[counts > 0])
+
+        # Written under a name of its own, then renamed, so readers never see a partial file
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'wb') as file:
+            np.savez(file, fingerprint=fingerprint, hist=hist)
+        os.replace(tmp_file, cache_file)
+
+    with cache_lock:
+        memory_cache[key] = (fingerprint, hist)
+
+    return hist
+
+def histogram_percentiles(hist, percentiles):
+    # PERCENTILE_CONT over the users described by the histogram
+    cumulative = np.cumsum(hist)
+    users = int(cumulative[-1]) if len(cumulative) else 0
+    if users == 0:
+        return [None for _ in percentiles]
+
+    results = []
+    for q in percentiles:
+        position = q * (users - 1)
+        lower = int(np.floor(position))
+        upper = int(np.ceil(position))
+        # value of the i-th smallest count is the first k whose cumulative count exceeds i
+        lower_value, upper_value = np.searchsorted(cumulative, [lower, upper], side="right")
+        results.append(float(lower_value + (position - lower) * (upper_value - lower_value)))
+    return results
+
+def window_percentiles(con, parquet_file, startDate, endDate, percentiles=PERCENTILES, exact=False):
+    # exact=True sorts the raw per user counts instead, for verifying the histogram path
+    if exact:
+        counts = user_counts(con, parquet_file, startDate, endDate)
+        counts = counts[counts > 0]
+        if len(counts) == 0:
+            return [None for _ in percentiles]
+        return [float(value) for value in np.percentile(counts, [q * 100 for q in percentiles])]
+
+    return histogram_percentiles(count_histogram(con, parquet_file, startDate, endDate), percentiles)
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from common.dates import checkDates, to_epoch_ms
+
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+
+    if len(args) not in (2, 3) or any(flag != "--exact" for flag in flags):
+        print("Usage: percentiles.py <start_date> <end_date> [percentiles, e.g. 50,75,90,99] [--exact]")
+        sys.exit(1)
+
+    start_date_str = args[0]
+    end_date_str = args[1]
+    percentiles = [float(p) / 100 for p in args[2].split(",")] if len(args) == 3 else PERCENTILES
+
+    startDate, endDate = checkDates(start_date_str, end_date_str)
+
+    startTime = time.perf_counter_ns()
+
+    results = window_percentiles(duckdb.connect(), './rPlace.parquet', to_epoch_ms(startDate), to_epoch_ms(endDate),
+                                 percentiles, exact="--exact" in flags)
+
+    elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+
+    print("**Percentiles of Pixels Placed**")
+    for q, value in zip(percentiles, results):
+        print(f"{q * 100:g}th Percentile: {value} pixels")
+    print(f"**Timeframe:** {start_date_str} to {end_date_str}")
+    print(f"**Execution Time:** {elapsedTime_ms:.4f} ms")
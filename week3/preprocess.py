@@ -1,80 +1,226 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
 import pandas as pd
-import webcolors
+import duckdb
 import pyarrow.csv as pv
 import pyarrow.parquet as pq
 import pyarrow as pa
 import polars as pl
 
-def csv_to_parquet_chunks():
-    # Read the CSV file in chunks (for memory efficiency with large files)
-    csv_file = '../../2022_place_canvas_history.csv'
-    parquet_file = 'rPlace.parquet'  # Output Parquet file path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.palette import RPLACE_PALETTE
+from common.canvas import KEYFRAME_INTERVAL_MS, build_keyframes
+from common.colstore import export_columns
+from common.rollup import build_rollup
+from common.tiles import TILE_SIZE, build_tile_index, morton_sql
+
+CSV_FILE = '../../2022_place_canvas_history.csv'
+PARQUET_FILE = 'rPlace.parquet'  # Output Parquet file path
+USER_ID_FILE = 'user_ids.parquet'  # user_id -> user_id_numerical dictionary
+PALETTE_FILE = 'palette.parquet'  # color_index -> pixel_color lookup table
+RECTANGLE_FILE = 'rPlace_rectangles.parquet'  # Moderator rectangle edits
+FIRST_SEEN_FILE = 'user_first_seen.parquet'  # First placement time of every user
+TILE_FILE = 'rPlace_tiles.parquet'  # Same rows, ordered by spatial tile
+TILE_INDEX_FILE = 'tile_index.parquet'  # tile -> row groups of TILE_FILE
+HOURLY_DIR = 'rPlace_hourly'  # Optional hour= partitioned copy of the output
+DATASET_DIR = 'rPlace_dataset'  # Parts written by --append, one per ingested csv
+ROLLUP_DIR = 'rollup'  # Hourly rollup cube of common/rollup.py, rebuilt by --merge if present
+KEYFRAME_DIR = 'keyframes'  # Canvas keyframes of common/canvas.py, rebuilt by --merge if present
+COLUMN_DIR = 'rPlace_columns'  # Optional raw column store of the output, see common/colstore.py
+ROW_GROUP_SIZE = 1_000_000
+
+
+def sort_by_timestamp(staging_file, parquet_file, row_group_size=ROW_GROUP_SIZE, partition_dir=None):
+    # Rewrite the batches in timestamp order so every row group covers a narrow time
+    # range; duckdb's external sort keeps this within memory on the full dataset.
+    # staging_file may also be a list of files, which are sorted together.
+    sources = staging_file if isinstance(staging_file, list) else [staging_file]
+    con = duckdb.connect()
+    con.execute(f"""
+                COPY (SELECT * FROM read_parquet({sources}) ORDER BY timestamp)
+                TO '{parquet_file}' (FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE {row_group_size})
+                """)
+
+    if partition_dir:
+        con.execute(f"""
+                    COPY (
+                        SELECT *, strftime(epoch_ms(timestamp), '%Y-%m-%d-%H') AS hour
+                        FROM read_parquet('{parquet_file}')
+                        ORDER BY timestamp
+                    )
+                    TO '{partition_dir}' (FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE {row_group_size},
+                                          PARTITION_BY (hour), OVERWRITE_OR_IGNORE)
+                    """)
+    con.close()
+
+    check_statistics(parquet_file, "timestamp")
+
+def write_user_first_seen(parquet_file, first_seen_file, row_group_size=ROW_GROUP_SIZE):
+    # One row per user with the time of their first placement, sorted by that time.
+    # The row group statistics on first_ts act as the index for range counts.
+    con = duckdb.connect()
+    con.execute(f"""
+                COPY (
+                    SELECT user_id_numerical AS user_id, MIN(timestamp) AS first_ts
+                    FROM read_parquet('{parquet_file}')
+                    GROUP BY user_id_numerical
+                    ORDER BY first_ts, user_id
+                )
+                TO '{first_seen_file}' (FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE {row_group_size})
+                """)
+    con.close()
+
+    check_statistics(first_seen_file, "first_ts")
+
+def write_tile_layout(parquet_file, tile_file, tile_index_file, tile_size=TILE_SIZE,
+                      row_group_size=ROW_GROUP_SIZE):
+    # Copy of the dataset in Z-order of fixed size tiles (then time), so region
+    # queries only need the few row groups holding their tiles
+    con = duckdb.connect()
+    con.execute(f"""
+                COPY (
+                    SELECT *, {morton_sql('x', 'y', tile_size)} AS tile
+                    FROM read_parquet('{parquet_file}')
+                    ORDER BY tile, timestamp
+                )
+                TO '{tile_file}' (FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE {row_group_size})
+                """)
+    con.close()
+
+    check_statistics(tile_file, "tile")
+    build_tile_index(tile_file, tile_index_file, tile_size)
+
+def check_statistics(parquet_file, column):
+    # Row group pruning only works if every row group carries min/max for the column
+    metadata = pq.ParquetFile(parquet_file).metadata
+    column_index = metadata.schema.names.index(column)
+
+    for i in range(metadata.num_row_groups):
+        statistics = metadata.row_group(i).column(column_index).statistics
+        if statistics is None or not statistics.has_min_max:
+            raise ValueError(f"Row group {i} of {parquet_file} has no min/max statistics for {column}")
+
+def extend_mapping(mapping, values, key, id_column):
+    # Append values not in the mapping yet with the next ids, in order of first appearance
+    new_values = (
+        values.select(pl.col(key).unique(maintain_order=True))
+        .join(mapping, on=key, how="anti")
+        .with_columns(
+            (pl.int_range(pl.len(), dtype=pl.Int64) + mapping.height)
+            .cast(mapping.schema[id_column])
+            .alias(id_column)
+        )
+    )
+    return pl.concat([mapping, new_values])
+
+def empty_user_id_mapping():
+    return pl.DataFrame(schema={"user_id": pl.Utf8, "user_id_numerical": pl.UInt32})
+
+def seed_palette():
+    # Seeded with the official palette so its indexes stay stable between runs
+    return pl.DataFrame({
+        "pixel_color": RPLACE_PALETTE,
+        "color_index": pl.Series(range(len(RPLACE_PALETTE)), dtype=pl.UInt8),
+    })
 
-    DATESTRING_FORMAT = "%Y-%m-%d %H:%M:%S"
+def convert_batch(record_batch, user_id_mapping, palette):
+    # One csv batch in the compact schema: (placements, rectangle edits, extended
+    # user id mapping, extended palette)
+    df = pl.from_arrow(record_batch)
+
+    # Milliseconds since the epoch (UTC), which is all the precision the csv has
+    df = df.with_columns(
+        pl.col("timestamp")
+        .str.replace(r" UTC$", "")  
+        .str.strptime(
+            pl.Datetime, 
+            format="%Y-%m-%d %H:%M:%S%.f",
+            strict=False
+        )
+        .dt.epoch("ms")
+        .alias("timestamp")
+    )
+
+    user_id_mapping = extend_mapping(user_id_mapping, df, "user_id", "user_id_numerical")
+    palette = extend_mapping(palette, df, "pixel_color", "color_index")
+    if palette.height > 256:
+        raise ValueError(f"{palette.height} distinct colors do not fit in a uint8 color index")
+
+    # map columns for numerical ids with a join instead of a per row lookup
+    df = (
+        df.join(user_id_mapping, on="user_id", how="left", maintain_order="left")
+        .join(palette, on="pixel_color", how="left", maintain_order="left")
+        .drop("user_id", "pixel_color")
+    )
+
+    # Moderator rectangle edits have two corners, keep them in their own table
+    corners = pl.col("coordinate").str.count_matches(",")
+    rectangles = (
+        df.filter(corners == 3)
+        .with_columns(
+            pl.col("coordinate")
+            .str.split_exact(",", 3)
+            .struct.rename_fields(["x1", "y1", "x2", "y2"])
+            .alias("corners")
+        )
+        .unnest("corners")
+        .with_columns(pl.col("x1", "y1", "x2", "y2").cast(pl.Int16))
+        .select("timestamp", "user_id_numerical", "color_index", "x1", "y1", "x2", "y2")
+    )
+
+    df = (
+        df.filter(corners == 1)
+        .with_columns(
+            pl.col("coordinate")
+            .str.split_exact(",", 1)
+            .struct.field("field_0")
+            .cast(pl.Int16)
+            .alias("x"),
+            pl.col("coordinate")
+            .str.split_exact(",", 1)
+            .struct.field("field_1")
+            .cast(pl.Int16)
+            .alias("y"),
+        )
+        .select("timestamp", "color_index", "x", "y", "user_id_numerical")
+    )
+
+    return df, rectangles, user_id_mapping, palette
+
+def csv_to_parquet_chunks(csv_file=CSV_FILE, parquet_file=PARQUET_FILE, user_id_file=USER_ID_FILE,
+                          row_group_size=ROW_GROUP_SIZE, partition_dir=None,
+                          palette_file=PALETTE_FILE, rectangle_file=RECTANGLE_FILE,
+                          first_seen_file=FIRST_SEEN_FILE, tile_file=TILE_FILE,
+                          tile_index_file=TILE_INDEX_FILE, column_dir=None):
+    # Batches are written in arrival order first, then sorted into parquet_file
+    staging_file = parquet_file.replace('.parquet', '.unsorted.parquet')
+
+    # Read the CSV file in chunks (for memory efficiency with large files)
     BLOCK_SIZE = 100_000_000
 
     read_options = pv.ReadOptions(block_size=BLOCK_SIZE)
     csv_reader = pv.open_csv(csv_file, read_options=read_options)
 
     parquet_writer = None
-    user_id_mapping = {}
-    user_id_counter = 0
+    user_id_mapping = empty_user_id_mapping()
+    palette = seed_palette()
+    rectangles = []
 
     try:
         for i, record_batch in enumerate(csv_reader):
             print(f"Processing batch with {record_batch.num_rows} rows...")
 
-            df = pl.from_arrow(record_batch)
-
-            df = df.with_columns(
-                pl.col("timestamp")
-                .str.replace(r" UTC$", "")  
-                .str.strptime(
-                    pl.Datetime, 
-                    format="%Y-%m-%d %H:%M:%S%.f",
-                    strict=False
-                )
-                .alias("timestamp")
-            )
-
-            # Map user_id to numerical values
-            user_ids = df["user_id"].unique().to_list()
-            for user_id in user_ids:
-                if user_id not in user_id_mapping:
-                    user_id_mapping[user_id] = user_id_counter
-                    user_id_counter += 1
-
-            df = (
-                df.filter(
-                    pl.col("coordinate").str.count_matches(",") == 1
-                )
-                .with_columns(
-                    pl.col("coordinate")
-                    .str.split_exact(",", 1)
-                    .struct.field("field_0")
-                    .cast(pl.Int64)
-                    .alias("x"),
-                    pl.col("coordinate")
-                    .str.split_exact(",", 1)
-                    .struct.field("field_1")
-                    .cast(pl.Int64)
-                    .alias("y"),
-                )
-                .drop("coordinate")
-                )
-
-            # map column for numerical ids
-            df = df.with_columns(
-                df["user_id"].map_elements(lambda x: user_id_mapping.get(x, None), return_dtype=pl.Int64).alias("user_id_numerical")
-            )
-
-            df = df.drop("user_id")
+            df, batch_rectangles, user_id_mapping, palette = convert_batch(record_batch, user_id_mapping, palette)
+            rectangles.append(batch_rectangles)
 
             table = df.to_arrow()
 
             if parquet_writer is None:
                 parquet_writer = pq.ParquetWriter(
-                    parquet_file, 
+                    staging_file, 
                     schema=table.schema, 
                     compression="zstd"
                 )
@@ -84,8 +230,221 @@ def csv_to_parquet_chunks():
         if parquet_writer:
             parquet_writer.close()
 
+    # Keep the dictionaries so ids can be decoded or reused without rebuilding them
+    user_id_mapping.write_parquet(user_id_file, compression="zstd")
+    palette.select("color_index", "pixel_color").write_parquet(palette_file)
+    pl.concat(rectangles).sort("timestamp").write_parquet(rectangle_file, compression="zstd")
+
+    print("Sorting by timestamp...")
+    sort_by_timestamp(staging_file, parquet_file, row_group_size, partition_dir)
+    os.remove(staging_file)
+
+    write_user_first_seen(parquet_file, first_seen_file, row_group_size)
+
+    print("Writing tile ordered layout...")
+    write_tile_layout(parquet_file, tile_file, tile_index_file, row_group_size=row_group_size)
+
+    if column_dir:
+        print("Exporting raw columns...")
+        export_columns(parquet_file, column_dir)
+
     print(f"Successfully converted {csv_file} to {parquet_file}")
+    print(f"Wrote {user_id_mapping.height} user ids to {user_id_file}")
+    print(f"Wrote {palette.height} colors to {palette_file}")
+    print(f"Wrote first placement times to {first_seen_file}")
+    print(f"Wrote tile ordered copy to {tile_file} with its index in {tile_index_file}")
+    if partition_dir:
+        print(f"Wrote hour partitioned copy to {partition_dir}")
+    if column_dir:
+        print(f"Wrote raw column store to {column_dir}")
+
+# Append mode. Each new csv becomes one part of DATASET_DIR, converted with the
+# persisted user id dictionary and palette so ids agree with everything ingested
+# before; only the new files are read. Files are recognised by content hash, so
+# re-running with the same input adds nothing, and every write is deterministic,
+# so ingesting the same files in the same order always gives byte-identical output.
+#
+#   rPlace_dataset/manifest.json                  ingested files and their parts
+#   rPlace_dataset/placements/part-NNNNN.parquet  placements of one file, by timestamp
+#   rPlace_dataset/rectangles/part-NNNNN.parquet  rectangle edits of that file
+#
+# The analyses only read rPlace.parquet and the files derived from it, so parts
+# become visible once --merge folds them in: the parts not merged yet are sorted
+# together with rPlace.parquet into a new rPlace.parquet, their rectangles join
+# rPlace_rectangles.parquet, the derived files are rebuilt, and the manifest lists
+# the parts as merged. A full build assigns user ids from scratch, so parts made
+# before it do not match it; start a new dataset directory after a full build.
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(16 * 1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(dataset_dir):
+    try:
+        with open(os.path.join(dataset_dir, 'manifest.json')) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"parts": []}
+
+def write_atomic(path, write):
+    tmp_file = path + '.tmp'
+    write(tmp_file)
+    os.replace(tmp_file, path)
+
+def write_part(df, path, row_group_size):
+    # Stable sort and fixed writer settings, so the same rows give the same bytes
+    table = df.sort("timestamp", maintain_order=True).to_arrow()
+    write_atomic(path, lambda tmp_file: pq.write_table(table, tmp_file, compression="zstd",
+                                                       row_group_size=row_group_size))
+
+def append_csv(csv_files, dataset_dir=DATASET_DIR, user_id_file=USER_ID_FILE, palette_file=PALETTE_FILE,
+               row_group_size=ROW_GROUP_SIZE):
+    manifest = load_manifest(dataset_dir)
+    ingested = {part["sha256"] for part in manifest["parts"]}
+
+    if os.path.exists(user_id_file):
+        user_id_mapping = pl.read_parquet(user_id_file).select("user_id", "user_id_numerical")
+    else:
+        user_id_mapping = empty_user_id_mapping()
+    if os.path.exists(palette_file):
+        palette = pl.read_parquet(palette_file).select("pixel_color", "color_index")
+    else:
+        palette = seed_palette()
+
+    os.makedirs(os.path.join(dataset_dir, 'placements'), exist_ok=True)
+    os.makedirs(os.path.join(dataset_dir, 'rectangles'), exist_ok=True)
+
+    added = 0
+    for csv_file in csv_files:
+        sha256 = file_sha256(csv_file)
+        if sha256 in ingested:
+            print(f"Skipping {csv_file}, already ingested")
+            continue
+
+        placements = []
+        rectangles = []
+        for record_batch in pv.open_csv(csv_file, read_options=pv.ReadOptions(block_size=100_000_000)):
+            print(f"Processing batch with {record_batch.num_rows} rows...")
+            df, batch_rectangles, user_id_mapping, palette = convert_batch(record_batch, user_id_mapping, palette)
+            placements.append(df)
+            rectangles.append(batch_rectangles)
+
+        name = f"part-{len(manifest['parts']):05d}.parquet"
+        placements = pl.concat(placements)
+        write_part(placements, os.path.join(dataset_dir, 'placements', name), row_group_size)
+        write_part(pl.concat(rectangles), os.path.join(dataset_dir, 'rectangles', name), row_group_size)
+
+        # Dictionaries first: a part is only listed once the ids it uses are saved
+        write_atomic(user_id_file, lambda tmp_file: user_id_mapping.write_parquet(tmp_file, compression="zstd"))
+        write_atomic(palette_file,
+                     lambda tmp_file: palette.select("color_index", "pixel_color").write_parquet(tmp_file))
+
+        manifest["parts"].append({
+            "source": os.path.basename(csv_file),
+            "sha256": sha256,
+            "part": name,
+            "rows": placements.height,
+            "min_timestamp": placements["timestamp"].min(),
+            "max_timestamp": placements["timestamp"].max(),
+        })
+        manifest["users"] = user_id_mapping.height
+        manifest["colors"] = palette.height
+
+        def write_manifest(tmp_file):
+            with open(tmp_file, 'w') as file:
+                json.dump(manifest, file, indent=2, sort_keys=True)
+        write_atomic(os.path.join(dataset_dir, 'manifest.json'), write_manifest)
+
+        ingested.add(sha256)
+        added += 1
+        print(f"Appended {csv_file} as {name} ({placements.height} rows)")
+
+    print(f"Ingested {added} new file(s) into {dataset_dir}, {len(manifest['parts'])} part(s) in total")
+    return added
+
+def merge_dataset(dataset_dir=DATASET_DIR, parquet_file=PARQUET_FILE, rectangle_file=RECTANGLE_FILE,
+                  first_seen_file=FIRST_SEEN_FILE, tile_file=TILE_FILE, tile_index_file=TILE_INDEX_FILE,
+                  row_group_size=ROW_GROUP_SIZE, partition_dir=None, column_dir=None, rollup_dir=ROLLUP_DIR,
+                  palette_file=PALETTE_FILE, keyframe_dir=KEYFRAME_DIR):
+    manifest = load_manifest(dataset_dir)
+    merged = set(manifest.get("merged", []))
+    parts = [part["part"] for part in manifest["parts"] if part["part"] not in merged]
+    if not parts:
+        print(f"Nothing to merge, every part of {dataset_dir} is already in {parquet_file}")
+        return 0
+
+    placement_files = [os.path.join(dataset_dir, 'placements', part) for part in parts]
+    rectangle_files = [os.path.join(dataset_dir, 'rectangles', part) for part in parts]
+
+    print(f"Merging {len(parts)} part(s) into {parquet_file}...")
+    sources = ([parquet_file] if os.path.exists(parquet_file) else []) + placement_files
+    merged_file = parquet_file.replace('.parquet', '.merged.parquet')
+    sort_by_timestamp(sources, merged_file, row_group_size, partition_dir)
+
+    rectangles = [pl.read_parquet(path) for path in [rectangle_file] + rectangle_files if os.path.exists(path)]
+    rectangles = pl.concat(rectangles).sort("timestamp", maintain_order=True)
+
+    # rPlace.parquet and the manifest are replaced back to back, so a part is
+    # listed as merged exactly when rPlace.parquet holds it
+    write_atomic(rectangle_file, lambda tmp_file: rectangles.write_parquet(tmp_file, compression="zstd"))
+    os.replace(merged_file, parquet_file)
+    manifest["merged"] = sorted(merged | set(parts))
+
+    def write_manifest(tmp_file):
+        with open(tmp_file, 'w') as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+    write_atomic(os.path.join(dataset_dir, 'manifest.json'), write_manifest)
+
+    # Everything derived from rPlace.parquet
+    write_user_first_seen(parquet_file, first_seen_file, row_group_size)
+    print("Writing tile ordered layout...")
+    write_tile_layout(parquet_file, tile_file, tile_index_file, row_group_size=row_group_size)
+    if column_dir or os.path.isdir(COLUMN_DIR):
+        print("Exporting raw columns...")
+        export_columns(parquet_file, column_dir or COLUMN_DIR)
+    if os.path.isdir(rollup_dir):
+        print("Rebuilding hourly rollups...")
+        build_rollup(os.path.abspath(parquet_file), os.path.abspath(rectangle_file), os.path.abspath(rollup_dir))
+    if os.path.isdir(keyframe_dir):
+        print("Rebuilding canvas keyframes...")
+        try:
+            with open(os.path.join(keyframe_dir, 'keyframes.json')) as file:
+                interval_ms = json.load(file)["interval_ms"]
+        except (OSError, ValueError, KeyError):
+            interval_ms = KEYFRAME_INTERVAL_MS
+        build_keyframes(parquet_file, rectangle_file, palette_file, keyframe_dir, interval_ms)
+
+    print(f"Merged {', '.join(parts)} into {parquet_file}")
+    return len(parts)
 
 
 if __name__ == "__main__":
-    csv_to_parquet_chunks()
+    parser = argparse.ArgumentParser(description="Convert the r/place csv into time sorted parquet")
+    parser.add_argument("--row-group-size", type=int, default=ROW_GROUP_SIZE,
+                        help="rows per parquet row group (default: %(default)s)")
+    parser.add_argument("--partition", action="store_true",
+                        help=f"also write a hive style hour= partitioned copy to {HOURLY_DIR}/")
+    parser.add_argument("--columns", action="store_true",
+                        help=f"also export memory mappable column files to {COLUMN_DIR}/")
+    parser.add_argument("--append", nargs="+", metavar="CSV",
+                        help=f"only convert these new csv files, as parts of {DATASET_DIR}/")
+    parser.add_argument("--merge", action="store_true",
+                        help=f"fold the parts of {DATASET_DIR}/ not merged yet into {PARQUET_FILE}")
+    parser.add_argument("--dataset-dir", default=DATASET_DIR,
+                        help="dataset directory for --append and --merge (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.append or args.merge:
+        if args.append:
+            append_csv(args.append, args.dataset_dir, row_group_size=args.row_group_size)
+        if args.merge:
+            merge_dataset(args.dataset_dir, row_group_size=args.row_group_size,
+                          partition_dir=HOURLY_DIR if args.partition else None,
+                          column_dir=COLUMN_DIR if args.columns else None)
+    else:
+        csv_to_parquet_chunks(row_group_size=args.row_group_size,
+                              partition_dir=HOURLY_DIR if args.partition else None,
+                              column_dir=COLUMN_DIR if args.columns else None)
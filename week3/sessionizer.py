@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import duckdb
+import numpy as np
+
+# Streaming sessionizer for the "Average Session Length" question. Events are read
+# ordered by (user, timestamp) in fixed size chunks and session boundaries are found
+# with vectorized gap detection; the only state kept between chunks is the session
+# that is still open at the end of the previous chunk.
+
+GAP_SECONDS = 900
+BATCH_ROWS = 1_000_000
+
+class Sessionizer:
+    def __init__(self, gap_seconds=GAP_SECONDS):
+        self.gap_ms = gap_seconds * 1000
+        self.open = None  # (user, start, end, count) of the session still being extended
+
+    def add(self, users, timestamps):
+        # Feed the next chunk of events sorted by (user, timestamp). Returns the
+        # sessions completed so far as arrays (users, starts, ends, counts).
+        if len(users) == 0:
+            return empty_sessions()
+
+        new_session = np.empty(len(users), dtype=bool)
+        new_session[0] = True
+        new_session[1:] = (users[1:] != users[:-1]) | (np.diff(timestamps) > self.gap_ms)
+
+        starts = np.flatnonzero(new_session)
+        ends = np.append(starts[1:], len(users)) - 1
+
+        session_users = users[starts]
+        session_starts = timestamps[starts]
+        session_ends = timestamps[ends]
+        session_counts = ends - starts + 1
+
+        continues = (self.open is not None and users[0] == self.open[0]
+                     and timestamps[0] - self.open[2] <= self.gap_ms)
+
+        if continues:
+            # The chunk opens by extending the carried session
+            session_starts[0] = self.open[1]
+            session_counts[0] += self.open[3]
+        elif self.open is not None:
+            session_users, session_starts, session_ends, session_counts = (
+                np.concatenate([[value], column])
+                for value, column in zip(self.open, (session_users, session_starts, session_ends, session_counts))
+            )
+
+        # The last session may continue in the next chunk, so hold it back
+        self.open = (session_users[-1], session_starts[-1], session_ends[-1], session_counts[-1])
+
+        return session_users[:-1], session_starts[:-1], session_ends[:-1], session_counts[:-1]
+
+    def finish(self):
+        if self.open is None:
+            return empty_sessions()
+        sessions = tuple(np.array([value]) for value in self.open)
+        self.open = None
+        return sessions
+
+def empty_sessions():
+    return tuple(np.array([], dtype=np.int64) for _ in range(4))
+
+def sorted_events(con, parquet_file, startDate, endDate, batch_rows=BATCH_ROWS):
+    # startDate/endDate are epoch milliseconds, like the timestamp column
+    reader = con.execute(f"""
+                        SELECT user_id_numerical, timestamp
+                        FROM parquet_scan('{parquet_file}')
+                        WHERE timestamp BETWEEN {startDate} AND {endDate}
+                        ORDER BY user_id_numerical, timestamp
+                        """).fetch_record_batch(batch_rows)
+
+    for batch in reader:
+        yield batch.column(0).to_numpy(), batch.column(1).to_numpy()
+
+def iter_sessions(con, parquet_file, startDate, endDate, gap_seconds=GAP_SECONDS, batch_rows=BATCH_ROWS):
+    # Yields (users, starts, ends, counts) arrays of sessions, one group per chunk
+    sessionizer = Sessionizer(gap_seconds)
+    for users, timestamps in sorted_events(con, parquet_file, startDate, endDate, batch_rows):
+        yield sessionizer.add(users.astype(np.int64), timestamps)
+    yield sessionizer.finish()
+
+def session_stats(con, parquet_file, startDate, endDate, gap_seconds=GAP_SECONDS, batch_rows=BATCH_ROWS):
+    # Summary over every session in the window. Like the original SQL, the average
+    # length only counts sessions with more than one event.
+    sessions = 0
+    events = 0
+    multi_event_sessions = 0
+    total_length_ms = 0
+    longest_ms = 0
+
+    for users, starts, ends, counts in iter_sessions(con, parquet_file, startDate, endDate, gap_seconds, batch_rows):
+        lengths = ends - starts
+        multi = counts > 1
+        sessions += len(counts)
+        events += int(counts.sum())
+        multi_event_sessions += int(multi.sum())
+        total_length_ms += int(lengths[multi].sum())
+        if len(lengths):
+            longest_ms = max(longest_ms, int(lengths.max()))
+
+    return {
+        "sessions": sessions,
+        "multi_event_sessions": multi_event_sessions,
+        "events_per_session": events / sessions if sessions else None,
+        "average_session_length": total_length_ms / multi_event_sessions / 1000 if multi_event_sessions else None,
+        "longest_session_length": longest_ms / 1000,
+    }
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from common.dates import checkDates, to_epoch_ms
+
+    if len(sys.argv) not in (3, 5) or (len(sys.argv) == 5 and sys.argv[3] != "--gap"):
+        print("Usage: sessionizer.py <start_date> <end_date> [--gap seconds]")
+        sys.exit(1)
+
+    start_date_str = sys.argv[1]
+    end_date_str = sys.argv[2]
+    gap_seconds = int(sys.argv[4]) if len(sys.argv) == 5 else GAP_SECONDS
+
+    startDate, endDate = checkDates(start_date_str, end_date_str)
+
+    startTime = time.perf_counter_ns()
+
+    stats = session_stats(duckdb.connect(), './rPlace.parquet', to_epoch_ms(startDate), to_epoch_ms(endDate), gap_seconds)
+
+    elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+
+    print(f"**Sessions:** {stats['sessions']}")
+    print(f"**Sessions With More Than One Event:** {stats['multi_event_sessions']}")
+    # Both are None for a window without (multi event) sessions
+    events_per_session = stats['events_per_session']
+    session_length = stats['average_session_length']
+    print("**Average Events per Session:** " + (f"{events_per_session:.2f}" if events_per_session is not None else "n/a"))
+    print("**Average Session Length:** " + (f"{session_length:.2f} seconds" if session_length is not None else "no sessions"))
+    print(f"**Longest Session:** {stats['longest_session_length']:.2f} seconds")
+    print(f"**Timeframe:** {start_date_str} to {end_date_str}")
+    print(f"**Execution Time:** {elapsedTime_ms:.4f} ms")
@@ -1,78 +1,60 @@
+import os
 import sys
 from datetime import datetime
 import time
 from collections import Counter
 import duckdb
-import webcolors
 import pandas as pd
 import matplotlib.pyplot as plt
 
-def hex_to_name(hex):
-    try:
-        return webcolors.hex_to_name(hex)
-    except ValueError:
-        return hex_to_closest_name(hex)
-
-def hex_to_closest_name(hex):
-    css3_colors = {name: webcolors.name_to_rgb(name) for name in webcolors.names("css3")}
-    target = webcolors.hex_to_rgb(hex)
-    # Find the closest color by calculating the Euclidean distance
-    closest_color = min(
-        css3_colors,
-        key=lambda name: sum((css3_colors[name][i] - target[i]) ** 2 for i in range(3))
-    )
-    return closest_color
-
-def premleague_analyzer():
-    parquet_file = '../rPlace.parquet'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.distinct import new_sketch
+from common.palette import names_for
+from common.result_cache import ResultCache
+from common.tiles import read_boxes
 
+def team_stats(coords, parquet_file, tile_file, tile_index_file, palette_file, distinct_mode="exact"):
+    # Distinct/common users of the two artworks and their color counts
     con = duckdb.connect()
     
     labels = ["arsenal", "spurs"]
 
-    # top left and bottom right for main artworks
-    coords = [[[704, 484], [752, 532]], [[1684, 420], [1714, 466]]]    
-
     x1_arsenal, y1_arsenal = coords[0][0]
     x2_arsenal, y2_arsenal = coords[0][1]
 
     x1_spurs, y1_spurs = coords[1][0]
     x2_spurs, y2_spurs = coords[1][1]
+
+    if os.path.exists(tile_file) and os.path.exists(tile_index_file):
+        # Only read the row groups of the tile ordered copy that hold the two artworks
+        boxes = [(x1_arsenal, y1_arsenal, x2_arsenal, y2_arsenal), (x1_spurs, y1_spurs, x2_spurs, y2_spurs)]
+        con.register("events", read_boxes(tile_file, tile_index_file, boxes,
+                                          columns=["x", "y", "color_index", "user_id_numerical"]))
+    else:
+        con.execute(f"CREATE VIEW events AS SELECT * FROM read_parquet('{parquet_file}')")
     
-    result = con.execute(f"""
-                            WITH arsenal_users AS (
-                                SELECT DISTINCT user_id_numerical as user_id
-                                FROM '{parquet_file}'
-                                WHERE x BETWEEN {x1_arsenal} AND {x2_arsenal}
-                                AND y BETWEEN {y1_arsenal} AND {y2_arsenal}
-                            ),
-                            spurs_users AS (
-                                SELECT DISTINCT user_id_numerical as user_id
-                                FROM '{parquet_file}'
-                                WHERE x BETWEEN {x1_spurs} AND {x2_spurs}
-                                AND y BETWEEN {y1_spurs} AND {y2_spurs}
-                            ),
-                            common_users AS (
-                                SELECT user_id FROM arsenal_users
-                                INTERSECT
-                                SELECT user_id FROM spurs_users
-                            )
+    # Per team user bitmaps (or HyperLogLog sketches), filled from a single scan
+    sketches = {label: new_sketch(distinct_mode) for label in labels}
+    reader = con.execute(f"""
                             SELECT 
-                                (SELECT COUNT(*) FROM arsenal_users) AS arsenal_user_count,
-                                (SELECT COUNT(*) FROM spurs_users) AS spurs_user_count,
-                                (SELECT COUNT(*) FROM common_users) AS common_user_count,
-                                (SELECT COUNT(*) FROM (
-                                    SELECT user_id FROM arsenal_users
-                                    UNION
-                                    SELECT user_id FROM spurs_users
-                                )) AS total_unique_users;
-                        """).fetchall()
-
-    # Print results
-    print("\n**Results**")
-    print(f"Arsenal Distinct Users: {result[0][0]}")
-    print(f"Spurs Distinct Users: {result[0][1]}")
-    print(f"Common Users: {result[0][2]}")
+                                CASE 
+                                    WHEN x BETWEEN {x1_arsenal} AND {x2_arsenal} AND y BETWEEN {y1_arsenal} AND {y2_arsenal} THEN 0
+                                    ELSE 1
+                                END AS team,
+                                user_id_numerical
+                            FROM events
+                            WHERE (x BETWEEN {x1_arsenal} AND {x2_arsenal} AND y BETWEEN {y1_arsenal} AND {y2_arsenal}) 
+                            OR (x BETWEEN {x1_spurs} AND {x2_spurs} AND y BETWEEN {y1_spurs} AND {y2_spurs})
+                        """).fetch_record_batch(1_000_000)
+
+    for batch in reader:
+        teams = batch.column(0).to_numpy()
+        users = batch.column(1).to_numpy()
+        for i, label in enumerate(labels):
+            sketches[label].add_many(users[teams == i])
+
+    arsenal_users, spurs_users = sketches["arsenal"], sketches["spurs"]
+    users = (arsenal_users.count(), spurs_users.count(), arsenal_users.intersection_cardinality(spurs_users))
 
     # Execute the query
     result = con.execute(f"""
@@ -82,22 +64,47 @@ def premleague_analyzer():
                                         WHEN x BETWEEN {x1_arsenal} AND {x2_arsenal} AND y BETWEEN {y1_arsenal} AND {y2_arsenal} THEN 'arsenal'
                                         WHEN x BETWEEN {x1_spurs} AND {x2_spurs} AND y BETWEEN {y1_spurs} AND {y2_spurs} THEN 'spurs'
                                     END AS team,
-                                    pixel_color, 
+                                    color_index, 
                                     COUNT(*) AS color_count
-                                FROM read_parquet('{parquet_file}')
+                                FROM events
                                 WHERE (x BETWEEN {x1_arsenal} AND {x2_arsenal} AND y BETWEEN {y1_arsenal} AND {y2_arsenal}) 
                                 OR (x BETWEEN {x1_spurs} AND {x2_spurs} AND y BETWEEN {y1_spurs} AND {y2_spurs})
-                                GROUP BY team, pixel_color
+                                GROUP BY team, color_index
                             )
-                            SELECT team, pixel_color, color_count
+                            SELECT team, palette.pixel_color, color_count
                             FROM color_counts
+                            JOIN read_parquet('{palette_file}') palette USING (color_index)
                             ORDER BY team, color_count DESC
                         """).fetchall()
                         
     df = pd.DataFrame(result, columns=["team", "pixel_color", "color_count"])
+    con.close()
+
+    return users, df
+
+def premleague_analyzer(distinct_mode="exact", cache=None):
+    parquet_file = '../rPlace.parquet'
+    tile_file = '../rPlace_tiles.parquet'
+    tile_index_file = '../tile_index.parquet'
+    palette_file = '../palette.parquet'
+    cache = cache or ResultCache(enabled=False)
+
+    # top left and bottom right for main artworks
+    coords = [[[704, 484], [752, 532]], [[1684, 420], [1714, 466]]]    
+
+    sources = [parquet_file, tile_file, tile_index_file, palette_file]
+    users, df = cache.cached("premleague.duckdb", sources, None, {"coords": coords, "distinct_mode": distinct_mode},
+                             lambda: team_stats(coords, parquet_file, tile_file, tile_index_file, palette_file,
+                                                distinct_mode))
+
+    # Print results
+    print("\n**Results**")
+    print(f"Arsenal Distinct Users: {users[0]}")
+    print(f"Spurs Distinct Users: {users[1]}")
+    print(f"Common Users: {users[2]}")
 
     # Convert pixel colors to English names
-    df["color_name"] = df["pixel_color"].apply(hex_to_name)
+    df["color_name"] = names_for(df["pixel_color"])
 
     # Separate data for Arsenal and Spurs
     arsenal_df = df[df["team"] == "arsenal"].head(5)  # Top 5 colors
@@ -138,5 +145,13 @@ def premleague_analyzer():
     plt.close()
 
 if __name__ == "__main__":
-    premleague_analyzer()
+    flags = sys.argv[1:]
+
+    if any(flag not in ("--approx", "--no-cache") for flag in flags):
+        print("Usage: duckdb_analyze.py [--approx] [--no-cache]")
+        sys.exit(1)
+
+    cache = ResultCache(enabled="--no-cache" not in flags)
+    premleague_analyzer("approx" if "--approx" in flags else "exact", cache)
+    print(cache.report())
 
@@ -1,49 +1,41 @@
+import os
 import sys
 from datetime import datetime
 import time
 from collections import Counter
 import pyspark
-import webcolors
 import pandas as pd
 import matplotlib.pyplot as plt
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import col , when, count
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.tiles import tiles_for_boxes
+from common.palette import names_for
+from common.result_cache import ResultCache
 
-def hex_to_name(hex):
-    try:
-        return webcolors.hex_to_name(hex)
-    except ValueError:
-        return hex_to_closest_name(hex)
-
-def hex_to_closest_name(hex):
-    css3_colors = {name: webcolors.name_to_rgb(name) for name in webcolors.names("css3")}
-    target = webcolors.hex_to_rgb(hex)
-    # Find the closest color by calculating the Euclidean distance
-    closest_color = min(
-        css3_colors,
-        key=lambda name: sum((css3_colors[name][i] - target[i]) ** 2 for i in range(3))
-    )
-    return closest_color
-
-def premleague_analyzer():
-    parquet_file = '../rPlace.parquet'
 
+def team_stats(coords, parquet_file, tile_file, tile_index_file, palette_file):
+    # Distinct/common users of the two artworks and their color counts
     # Initialize Spark Session
     spark = SparkSession.builder.appName("PremierLeagueAnalyzer").getOrCreate()
 
-    # Load Parquet File
-    df = spark.read.parquet(parquet_file)
-
-    # Define coordinate ranges
-    coords = [[[704, 484], [752, 532]], [[1684, 420], [1714, 466]]]    
-
     x1_arsenal, y1_arsenal = coords[0][0]
     x2_arsenal, y2_arsenal = coords[0][1]
 
     x1_spurs, y1_spurs = coords[1][0]
     x2_spurs, y2_spurs = coords[1][1]
 
+    # Load Parquet File
+    if os.path.exists(tile_file) and os.path.exists(tile_index_file):
+        # Filtering the tile ordered copy on its tile column lets the parquet reader
+        # skip every row group outside the two artworks
+        boxes = [(x1_arsenal, y1_arsenal, x2_arsenal, y2_arsenal), (x1_spurs, y1_spurs, x2_spurs, y2_spurs)]
+        df = spark.read.parquet(tile_file).filter(col("tile").isin(tiles_for_boxes(tile_index_file, boxes)))
+    else:
+        df = spark.read.parquet(parquet_file)
+    palette = spark.read.parquet(palette_file)
+
     # Define conditions for Arsenal and Spurs
     arsenal_cond = (col("x").between(x1_arsenal, x2_arsenal) & col("y").between(y1_arsenal, y2_arsenal))
     spurs_cond = (col("x").between(x1_spurs, x2_spurs) & col("y").between(y1_spurs, y2_spurs))
@@ -58,27 +50,47 @@ def premleague_analyzer():
     spurs_count = spurs_users.count()
     common_count = common_users.count()
 
-    # Print results
-    print("\n**Results**")
-    print(f"Arsenal Distinct Users: {arsenal_count}")
-    print(f"Spurs Distinct Users: {spurs_count}")
-    print(f"Common Users: {common_count}")
-
     # Count colors in each team's artwork
     color_counts = df.filter(arsenal_cond | spurs_cond) \
                      .groupBy(
                          when(arsenal_cond, "arsenal")
                          .when(spurs_cond, "spurs")
                          .alias("team"),
-                         col("pixel_color")
+                         col("color_index")
                      ) \
                      .agg(count("*").alias("color_count")) \
+                     .join(palette, "color_index") \
                      .orderBy("team", col("color_count").desc())
 
     # Convert to Pandas DataFrame
     df = color_counts.toPandas()
 
-    df["color_name"] = df["pixel_color"].apply(hex_to_name)
+    # Stop Spark Session
+    spark.stop()
+
+    return (arsenal_count, spurs_count, common_count), df
+
+def premleague_analyzer(cache=None):
+    parquet_file = '../rPlace.parquet'
+    palette_file = '../palette.parquet'
+    tile_file = '../rPlace_tiles.parquet'
+    tile_index_file = '../tile_index.parquet'
+    cache = cache or ResultCache(enabled=False)
+
+    # Define coordinate ranges
+    coords = [[[704, 484], [752, 532]], [[1684, 420], [1714, 466]]]    
+
+    sources = [parquet_file, tile_file, tile_index_file, palette_file]
+    users, df = cache.cached("premleague.spark", sources, None, {"coords": coords},
+                             lambda: team_stats(coords, parquet_file, tile_file, tile_index_file, palette_file))
+
+    # Print results
+    print("\n**Results**")
+    print(f"Arsenal Distinct Users: {users[0]}")
+    print(f"Spurs Distinct Users: {users[1]}")
+    print(f"Common Users: {users[2]}")
+
+    df["color_name"] = names_for(df["pixel_color"])
 
     # Separate data for Arsenal and Spurs
     arsenal_df = df[df["team"] == "arsenal"].head(5)  
@@ -118,8 +130,13 @@ def premleague_analyzer():
     plt.savefig("./spurs_pie_chart_pyspark.png", facecolor="grey")
     plt.close()
 
-    # Stop Spark Session
-    spark.stop()
-
 if __name__ == "__main__":
-    premleague_analyzer()
+    flags = sys.argv[1:]
+
+    if any(flag != "--no-cache" for flag in flags):
+        print("Usage: pyspark_analyze.py [--no-cache]")
+        sys.exit(1)
+
+    cache = ResultCache(enabled="--no-cache" not in flags)
+    premleague_analyzer(cache)
+    print(cache.report())
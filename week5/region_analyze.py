@@ -0,0 +1,177 @@
+import csv
+import json
+import os
+import sys
+import time
+import numpy as np
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.distinct import new_sketch
+from common.result_cache import ResultCache
+from common.tiles import CANVAS_SIZE, row_groups_for_box
+
+# Region analysis over any number of named artworks in one pass over the data.
+# Regions come from a json config, each either a rectangle
+#     {"name": "arsenal", "rect": [x1, y1, x2, y2]}        (inclusive corners)
+# or a polygon
+#     {"name": "heart", "polygon": [[x, y], [x, y], ...]}
+# For every region we keep a bitmap of its users and a color histogram; the
+# pairwise user overlap matrix is computed from the bitmaps at the end.
+#
+# Each batch is sorted by pixel (y * CANVAS_SIZE + x), so every row of a region's
+# bounding box is one contiguous slice found by binary search: a region only
+# touches its own placements, however many regions there are.
+
+BATCH_ROWS = 1_000_000
+
+def load_regions(config_file):
+    with open(config_file) as file:
+        config = json.load(file)
+
+    regions = []
+    for region in config["regions"]:
+        if "rect" in region:
+            x1, y1, x2, y2 = region["rect"]
+            regions.append({"name": region["name"], "bbox": (x1, y1, x2, y2), "polygon": None})
+        elif "polygon" in region:
+            polygon = np.array(region["polygon"], dtype=np.float64)
+            x1, y1 = np.floor(polygon.min(axis=0)).astype(int)
+            x2, y2 = np.ceil(polygon.max(axis=0)).astype(int)
+            regions.append({"name": region["name"], "bbox": (x1, y1, x2, y2), "polygon": polygon})
+        else:
+            raise ValueError(f"Region '{region.get('name')}' needs either a 'rect' or a 'polygon'")
+    return regions
+
+def in_polygon(x, y, polygon):
+    # Even-odd rule, tested at pixel centers
+    px = x + 0.5
+    py = y + 0.5
+    inside = np.zeros(len(x), dtype=bool)
+    for (ax, ay), (bx, by) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        crosses = (ay > py) != (by > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            at_x = ax + (py - ay) * (bx - ax) / (by - ay)
+        inside ^= crosses & (px < at_x)
+    return inside
+
+def region_rows(region, keys, x, y):
+    # Indexes of the placements inside the region, given the pixel keys sorted
+    x1, y1, x2, y2 = region["bbox"]
+    x1, y1 = max(x1, 0), max(y1, 0)
+    x2, y2 = min(x2, CANVAS_SIZE - 1), min(y2, CANVAS_SIZE - 1)
+    if x1 > x2 or y1 > y2:
+        return np.zeros(0, dtype=np.int64)
+
+    # One [lo, hi) slice per bounding box row, concatenated
+    rows = np.arange(y1, y2 + 1, dtype=np.int64) * CANVAS_SIZE
+    lo = np.searchsorted(keys, rows + x1, side="left")
+    hi = np.searchsorted(keys, rows + x2, side="right")
+    lengths = hi - lo
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    index = np.repeat(lo - starts, lengths) + np.arange(total)
+
+    if region["polygon"] is not None:
+        index = index[in_polygon(x[index], y[index], region["polygon"])]
+    return index
+
+def iter_batches(parquet_file, tile_file, tile_index_file, regions):
+    columns = ["x", "y", "color_index", "user_id_numerical"]
+    if os.path.exists(tile_file) and os.path.exists(tile_index_file):
+        # Only the row groups of the tile ordered copy that touch some region
+        row_groups = sorted(set().union(*(row_groups_for_box(tile_index_file, *region["bbox"])
+                                          for region in regions)))
+        if not row_groups:
+            return
+        yield from pq.ParquetFile(tile_file).iter_batches(BATCH_ROWS, row_groups=row_groups, columns=columns)
+    else:
+        yield from pq.ParquetFile(parquet_file).iter_batches(BATCH_ROWS, columns=columns)
+
+def analyze_regions(regions, parquet_file, tile_file, tile_index_file, distinct_mode="exact"):
+    users = [new_sketch(distinct_mode) for _ in regions]
+    colors = np.zeros((len(regions), 256), dtype=np.int64)
+
+    # Pixels covered by any region's bounding box, to drop everything else early
+    covered = np.zeros((CANVAS_SIZE, CANVAS_SIZE), dtype=bool)
+    for region in regions:
+        x1, y1, x2, y2 = region["bbox"]
+        covered[max(y1, 0):y2 + 1, max(x1, 0):x2 + 1] = True
+
+    for batch in iter_batches(parquet_file, tile_file, tile_index_file, regions):
+        x = batch.column("x").to_numpy().astype(np.int32)
+        y = batch.column("y").to_numpy().astype(np.int32)
+        keep = covered[np.clip(y, 0, CANVAS_SIZE - 1), np.clip(x, 0, CANVAS_SIZE - 1)]
+        if not keep.any():
+            continue
+
+        keep = np.flatnonzero(keep)
+        keys = y[keep].astype(np.int64) * CANVAS_SIZE + x[keep]
+        order = np.argsort(keys, kind="stable")
+        keep = keep[order]
+        keys = keys[order]
+
+        x = x[keep]
+        y = y[keep]
+        color = batch.column("color_index").to_numpy()[keep]
+        user = batch.column("user_id_numerical").to_numpy()[keep]
+
+        for i, region in enumerate(regions):
+            rows = region_rows(region, keys, x, y)
+            if len(rows):
+                users[i].add_many(user[rows])
+                colors[i] += np.bincount(color[rows], minlength=256)
+
+    overlap = np.zeros((len(regions), len(regions)), dtype=np.int64)
+    for i in range(len(regions)):
+        overlap[i, i] = users[i].count()
+        for j in range(i + 1, len(regions)):
+            overlap[i, j] = overlap[j, i] = users[i].intersection_cardinality(users[j])
+
+    return overlap, colors
+
+def write_overlap(regions, overlap, overlap_file):
+    names = [region["name"] for region in regions]
+    with open(overlap_file, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["region"] + names)
+        for name, row in zip(names, overlap):
+            writer.writerow([name] + row.tolist())
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+
+    if len(args) > 1 or any(flag not in ("--approx", "--no-cache") for flag in flags):
+        print("Usage: region_analyze.py [regions.json] [--approx] [--no-cache]")
+        sys.exit(1)
+
+    config_file = args[0] if args else './regions.json'
+    palette_file = '../palette.parquet'
+    data_files = ['../rPlace.parquet', '../rPlace_tiles.parquet', '../tile_index.parquet']
+    distinct_mode = "approx" if "--approx" in flags else "exact"
+    cache = ResultCache(enabled="--no-cache" not in flags)
+
+    startTime = time.perf_counter_ns()
+
+    regions = load_regions(config_file)
+    # The regions come from the config file, so its fingerprint is part of the key
+    overlap, colors = cache.cached("regions", [config_file] + data_files, None, {"distinct_mode": distinct_mode},
+                                   lambda: analyze_regions(regions, *data_files, distinct_mode))
+
+    elapsedTime_ms = (time.perf_counter_ns() - startTime) / 1_000_000
+
+    palette = dict(zip(*pq.read_table(palette_file).to_pydict().values()))
+
+    print("\n**Results**")
+    for i, region in enumerate(regions):
+        top = np.argsort(colors[i])[::-1][:3]
+        top_colors = ", ".join(f"{palette[c]} ({colors[i][c]})" for c in top if colors[i][c])
+        print(f"{region['name']} Distinct Users: {overlap[i, i]}, Top Colors: {top_colors}")
+
+    write_overlap(regions, overlap, './region_overlap.csv')
+    print("User overlap matrix written to ./region_overlap.csv")
+    print(f"**Execution Time:** {elapsedTime_ms:.4f} ms")
+    print(cache.report())